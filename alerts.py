@@ -1,10 +1,18 @@
 """Alert service for sending notifications via SMS, WhatsApp, and email."""
 from __future__ import annotations
 
+import copy
+import json
 import logging
+import queue
 import smtplib
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
 from email.message import EmailMessage
-from typing import Optional, Sequence
+from typing import Callable, Optional, Sequence
 
 try:
     from twilio.base.exceptions import TwilioRestException
@@ -27,22 +35,117 @@ from db import Listing, Subscriber, get_all_subscribers, mark_listings_notified
 
 logger = logging.getLogger(__name__)
 
+# Twilio clients are shared process-wide so every AlertService reuses the same
+# underlying HTTP session (and its keep-alive connections) to api.twilio.com.
+_CLIENT_CACHE: dict[tuple[str, str], Client] = {}
+_CLIENT_LOCK = threading.Lock()
+
+
+def _get_twilio_client(settings: Settings) -> Client:
+    """Return the shared Twilio client for the configured credentials."""
+    key = (settings.twilio_account_sid or "", settings.twilio_auth_token or "")
+    client = _CLIENT_CACHE.get(key)
+    if client is None:
+        with _CLIENT_LOCK:
+            client = _CLIENT_CACHE.get(key)
+            if client is None:
+                client = Client(*key)
+                _CLIENT_CACHE[key] = client
+    return client
+
+
+def reset() -> None:
+    """Drop shared Twilio clients so the next AlertService uses current settings."""
+    with _CLIENT_LOCK:
+        _CLIENT_CACHE.clear()
+
+
+# Outbound message templates keyed on (has_price, has_title, has_neighborhood).
+_MESSAGE_FORMATTERS: dict[tuple[bool, bool, bool], Callable[[Listing], str]] = {
+    (True, True, True): lambda l: f"New Listing: {l.price} - {l.title} in {l.neighborhood}. Link: {l.url}",
+    (True, True, False): lambda l: f"New Listing: {l.price} - {l.title}. Link: {l.url}",
+    (True, False, True): lambda l: f"New Listing: {l.price} in {l.neighborhood}. Link: {l.url}",
+    (True, False, False): lambda l: f"New Listing: {l.price}. Link: {l.url}",
+    (False, True, True): lambda l: f"New Listing: {l.title} in {l.neighborhood}. Link: {l.url}",
+    (False, True, False): lambda l: f"New Listing: {l.title}. Link: {l.url}",
+    (False, False, True): lambda l: f"New Listing: in {l.neighborhood}. Link: {l.url}",
+    (False, False, False): lambda l: f"New Listing:. Link: {l.url}",
+}
+
 
 def _format_message(listing: Listing) -> str:
     """Format an outbound SMS for a listing."""
-    parts = ["New Listing:"]
-    if listing.price:
-        parts.append(f"{listing.price}")
-    if listing.title:
-        if listing.price:
-            parts.append(f"- {listing.title}")
-        else:
-            parts.append(listing.title)
-    if listing.neighborhood:
-        parts.append(f"in {listing.neighborhood}")
-    message = " ".join(parts).strip()
-    message = f"{message}. Link: {listing.url}"
-    return message
+    key = (bool(listing.price), bool(listing.title), bool(listing.neighborhood))
+    return _MESSAGE_FORMATTERS[key](listing)
+
+
+def _whatsapp_content_variables(listing: Listing) -> str:
+    """Serialize listing fields for the WhatsApp content template placeholders."""
+    return json.dumps(
+        {
+            "1": listing.price or "",
+            "2": listing.title or "",
+            "3": listing.neighborhood or "",
+            "4": listing.url,
+        }
+    )
+
+
+# Channel bits for _Recipient.channel_mask.
+_CHANNEL_SMS = 0b001
+_CHANNEL_WHATSAPP = 0b010
+_CHANNEL_EMAIL = 0b100
+_CHANNEL_BITS = {"sms": _CHANNEL_SMS, "whatsapp": _CHANNEL_WHATSAPP, "email": _CHANNEL_EMAIL}
+_TWILIO_CHANNELS = _CHANNEL_SMS | _CHANNEL_WHATSAPP
+
+
+@dataclass(frozen=True)
+class _Recipient:
+    """A subscriber whose channel preferences were normalized once per batch."""
+
+    subscriber: Subscriber
+    channel_mask: int
+    whatsapp_to: Optional[str]
+
+
+def _channel_mask(channels: Sequence[str]) -> int:
+    """Fold channel names into a bitmask of the known channels."""
+    mask = 0
+    for channel in channels:
+        mask |= _CHANNEL_BITS.get(channel.lower(), 0)
+    return mask
+
+
+def _whatsapp_address(subscriber: Subscriber) -> Optional[str]:
+    """Return the subscriber's WhatsApp destination in Twilio's `whatsapp:` form."""
+    destination = subscriber.whatsapp or subscriber.phone
+    if not destination:
+        return None
+    return destination if destination.startswith("whatsapp:") else f"whatsapp:{destination}"
+
+
+def _prepare_recipients(subscribers: Sequence[Subscriber]) -> list[_Recipient]:
+    """Normalize channels and destinations up front instead of per listing."""
+    return [
+        _Recipient(
+            subscriber,
+            _channel_mask(subscriber.channel_preferences),
+            _whatsapp_address(subscriber),
+        )
+        for subscriber in subscribers
+    ]
+
+
+@dataclass(frozen=True)
+class _ChannelRecipients:
+    """Recipients that can actually be reached on each channel in this batch."""
+
+    sms: list[_Recipient]
+    whatsapp: list[_Recipient]
+    email: list[_Recipient]
+
+    def __bool__(self) -> bool:
+        return bool(self.sms or self.whatsapp or self.email)
 
 
 class AlertService:
@@ -60,10 +163,7 @@ class AlertService:
             if not TWILIO_AVAILABLE:
                 logger.error("Twilio SDK not installed; cannot send alerts.")
                 return None
-            self._client = Client(
-                self.settings.twilio_account_sid,
-                self.settings.twilio_auth_token,
-            )
+            self._client = _get_twilio_client(self.settings)
         return self._client
 
     def send_alerts(self, listings: Sequence[Listing]) -> int:
@@ -81,101 +181,147 @@ class AlertService:
             logger.info("No subscribers; skipping alerts.")
             return 0
 
+        recipients = _prepare_recipients(subscribers)
         twilio_client = self.client if self.settings.twilio_configured else None
-        self._warn_if_missing_credentials(subscribers, twilio_client)
+        self._warn_if_missing_credentials(recipients, twilio_client)
+
+        channel_recipients = self._partition_recipients(recipients, twilio_client)
+
+        delivered: dict[str, bool] = defaultdict(bool)
+        # (channel, post_id, destination, error) per failed send, logged once below.
+        send_failures: list[tuple[str, str, str, str]] = []
+        if channel_recipients:
+            # Sends are network-bound, so they are dispatched concurrently. Email
+            # alerts share one SMTP session for the whole batch.
+            with self._email_service or nullcontext(), ThreadPoolExecutor(
+                max_workers=self.settings.alert_send_workers
+            ) as executor:
+                pending = [
+                    (listing.post_id, future)
+                    for listing in listings
+                    for future in self._dispatch_listing_alerts(
+                        executor, listing, channel_recipients, twilio_client, send_failures
+                    )
+                ]
+                for post_id, future in pending:
+                    if future.result():
+                        delivered[post_id] = True
 
         notified_post_ids: list[str] = []
+        failed_post_ids: list[str] = []
         for listing in listings:
-            if self._send_listing_alerts(listing, subscribers, twilio_client):
+            if delivered[listing.post_id]:
                 notified_post_ids.append(listing.post_id)
+            else:
+                failed_post_ids.append(listing.post_id)
 
         if notified_post_ids:
             mark_listings_notified(notified_post_ids)
+
+        # One summary per batch rather than a log record per listing or send.
+        if send_failures:
+            logger.error(
+                "Failed alert sends",
+                extra={"failures": send_failures},
+            )
+        if failed_post_ids:
+            logger.error(
+                "Failed to deliver listing alerts to any subscriber",
+                extra={"post_ids": failed_post_ids},
+            )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Alert batch complete",
+                extra={
+                    "listing_count": len(listings),
+                    "subscriber_count": len(recipients),
+                    "notified": len(notified_post_ids),
+                    "failed": len(failed_post_ids),
+                },
+            )
         
         return len(notified_post_ids)
 
     def _warn_if_missing_credentials(
         self, 
-        subscribers: Sequence[Subscriber], 
+        recipients: Sequence[_Recipient], 
         twilio_client: Optional[Client]
     ) -> None:
         """Warn if subscribers need SMS/WhatsApp but Twilio is not configured."""
         if twilio_client is None:
-            needs_twilio = any(
-                {"sms", "whatsapp"}.intersection(sub.channel_preferences) 
-                for sub in subscribers
-            )
-            if needs_twilio:
+            requested = 0
+            for recipient in recipients:
+                requested |= recipient.channel_mask
+            if requested & _TWILIO_CHANNELS:
                 logger.warning("Twilio credentials missing; SMS/WhatsApp alerts will be skipped.")
 
-    def _send_listing_alerts(
+    def _partition_recipients(
         self,
-        listing: Listing,
-        subscribers: Sequence[Subscriber],
+        recipients: Sequence[_Recipient],
         twilio_client: Optional[Client]
-    ) -> bool:
-        """
-        Send alert for a single listing to all subscribers.
-        
-        Returns:
-            True if at least one subscriber was successfully notified.
-        """
-        message_body = _format_message(listing)
-        logger.info(
-            "Sending alerts for listing",
-            extra={"post_id": listing.post_id, "subscriber_count": len(subscribers)},
+    ) -> _ChannelRecipients:
+        """Split recipients per channel, dropping channels that cannot be sent."""
+        can_whatsapp = twilio_client is not None and self.settings.whatsapp_configured
+        return _ChannelRecipients(
+            sms=[
+                recipient for recipient in recipients
+                if twilio_client is not None and recipient.subscriber.phone and recipient.channel_mask & _CHANNEL_SMS
+            ],
+            whatsapp=[
+                recipient for recipient in recipients
+                if can_whatsapp and recipient.whatsapp_to and recipient.channel_mask & _CHANNEL_WHATSAPP
+            ],
+            email=[
+                recipient for recipient in recipients
+                if self._email_service and recipient.subscriber.email and recipient.channel_mask & _CHANNEL_EMAIL
+            ],
         )
-        
-        delivered_to_any = False
-        for subscriber in subscribers:
-            if self._send_to_subscriber(listing, subscriber, message_body, twilio_client):
-                delivered_to_any = True
-
-        if not delivered_to_any:
-            logger.error(
-                "Failed to deliver listing alert to any subscriber",
-                extra={"post_id": listing.post_id},
-            )
-        
-        return delivered_to_any
 
-    def _send_to_subscriber(
+    def _dispatch_listing_alerts(
         self,
+        executor: ThreadPoolExecutor,
         listing: Listing,
-        subscriber: Subscriber,
-        message_body: str,
-        twilio_client: Optional[Client]
-    ) -> bool:
+        channel_recipients: _ChannelRecipients,
+        twilio_client: Optional[Client],
+        send_failures: list[tuple[str, str, str, str]]
+    ) -> list[Future[bool]]:
         """
-        Send alert to a single subscriber via all their preferred channels.
+        Queue alerts for a single listing on every reachable channel.
         
         Returns:
-            True if delivery succeeded on at least one channel.
+            One future per send resolving to True when delivery succeeded.
         """
-        delivered = False
-        for channel in subscriber.channel_preferences:
-            channel_lower = channel.lower()
-            
-            if channel_lower == "sms":
-                delivered |= self._send_sms(listing, subscriber, message_body, twilio_client)
-            elif channel_lower == "whatsapp":
-                delivered |= self._send_whatsapp(listing, subscriber, message_body, twilio_client)
-            elif channel_lower == "email":
-                delivered |= self._send_email(listing, subscriber, message_body)
-        
-        return delivered
+        message_body = _format_message(listing)
+        futures: list[Future[bool]] = [
+            executor.submit(
+                self._send_sms, listing, recipient.subscriber, message_body, twilio_client, send_failures
+            )
+            for recipient in channel_recipients.sms
+        ]
+        futures.extend(
+            executor.submit(
+                self._send_whatsapp, listing, recipient, message_body, twilio_client, send_failures
+            )
+            for recipient in channel_recipients.whatsapp
+        )
+        if channel_recipients.email and self._email_service:
+            # Headers and MIME body are built once; each send only swaps the recipient.
+            template = self._email_service.build_listing_message(listing, message_body)
+            futures.extend(
+                executor.submit(self._send_email, listing, recipient.subscriber, template)
+                for recipient in channel_recipients.email
+            )
+        return futures
 
     def _send_sms(
         self,
         listing: Listing,
         subscriber: Subscriber,
         message_body: str,
-        twilio_client: Optional[Client]
+        twilio_client: Client,
+        send_failures: list[tuple[str, str, str, str]]
     ) -> bool:
         """Send SMS alert to subscriber."""
-        if not (twilio_client and subscriber.phone):
-            return False
-        
         try:
             twilio_client.messages.create(
                 body=message_body,
@@ -184,10 +330,7 @@ class AlertService:
             )
             return True
         except TwilioRestException as exc:
-            logger.error(
-                "Failed SMS alert",
-                extra={"post_id": listing.post_id, "phone": subscriber.phone, "error": str(exc)},
-            )
+            send_failures.append(("sms", listing.post_id, subscriber.phone, str(exc)))
         except Exception as exc:  # pragma: no cover - defensive logging
             logger.exception(
                 "Unexpected SMS error",
@@ -198,37 +341,38 @@ class AlertService:
     def _send_whatsapp(
         self,
         listing: Listing,
-        subscriber: Subscriber,
+        recipient: _Recipient,
         message_body: str,
-        twilio_client: Optional[Client]
+        twilio_client: Client,
+        send_failures: list[tuple[str, str, str, str]]
     ) -> bool:
         """Send WhatsApp alert to subscriber."""
-        if not (twilio_client and self.settings.whatsapp_configured):
-            return False
-        
-        destination = subscriber.whatsapp or subscriber.phone
-        if not destination:
-            return False
-        
-        to_number = destination if destination.startswith("whatsapp:") else f"whatsapp:{destination}"
+        to_number = recipient.whatsapp_to
         from_number = self.settings.twilio_whatsapp_from_number
+        content_sid = self.settings.twilio_whatsapp_content_sid
         
         try:
-            twilio_client.messages.create(
-                body=message_body,
-                from_=from_number,
-                to=to_number,
-            )
+            if content_sid:
+                # Approved content templates go through Twilio's higher-throughput path.
+                twilio_client.messages.create(
+                    content_sid=content_sid,
+                    content_variables=_whatsapp_content_variables(listing),
+                    from_=from_number,
+                    to=to_number,
+                )
+            else:
+                twilio_client.messages.create(
+                    body=message_body,
+                    from_=from_number,
+                    to=to_number,
+                )
             return True
         except TwilioRestException as exc:
-            logger.error(
-                "Failed WhatsApp alert",
-                extra={"post_id": listing.post_id, "phone": destination, "error": str(exc)},
-            )
+            send_failures.append(("whatsapp", listing.post_id, to_number, str(exc)))
         except Exception as exc:  # pragma: no cover
             logger.exception(
                 "Unexpected WhatsApp error",
-                extra={"post_id": listing.post_id, "phone": destination, "error": str(exc)},
+                extra={"post_id": listing.post_id, "phone": to_number, "error": str(exc)},
             )
         return False
 
@@ -236,14 +380,11 @@ class AlertService:
         self,
         listing: Listing,
         subscriber: Subscriber,
-        message_body: str
+        template: EmailMessage
     ) -> bool:
         """Send email alert to subscriber."""
-        if not (self._email_service and subscriber.email):
-            return False
-        
         try:
-            self._email_service.send_listing_email(subscriber.email, listing, message_body)
+            self._email_service.send_listing_email(subscriber.email, template)
             return True
         except Exception as exc:  # pragma: no cover - defensive logging
             logger.exception(
@@ -253,29 +394,123 @@ class AlertService:
         return False
 
 
+class SMTPPool:
+    """
+    Fixed-size pool of SMTP sessions shared by sender threads.
+    
+    Sessions are opened lazily on first use, so a pool only ever holds as many
+    logged-in connections as the batch actually needed concurrently.
+    """
+
+    def __init__(self, connect: Callable[[], smtplib.SMTP], size: int) -> None:
+        self._connect = connect
+        self._idle: queue.Queue[Optional[smtplib.SMTP]] = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._idle.put(None)
+
+    def acquire(self) -> smtplib.SMTP:
+        """Take a session from the pool, connecting if the slot is empty."""
+        smtp = self._idle.get()
+        if smtp is None:
+            try:
+                smtp = self._connect()
+            except BaseException:
+                self._idle.put(None)
+                raise
+        return smtp
+
+    def release(self, smtp: Optional[smtplib.SMTP]) -> None:
+        """Return a session to the pool; pass None to give back an empty slot."""
+        self._idle.put(smtp)
+
+    def close(self) -> None:
+        """Quit every idle session in the pool."""
+        while True:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            if smtp is None:
+                continue
+            try:
+                smtp.quit()
+            except smtplib.SMTPException:  # pragma: no cover - connection already gone
+                smtp.close()
+
+
 class EmailService:
-    """Simple SMTP email sender for listing alerts."""
+    """
+    Simple SMTP email sender for listing alerts.
+    
+    Used as a context manager, emails sent inside the block are spread over a
+    pool of persistent SMTP sessions instead of reconnecting per message.
+    Overlapping blocks (e.g. an alert run during a digest) share one pool,
+    which is closed when the last of them exits.
+    """
 
     def __init__(self, settings: Settings) -> None:
         self.settings = settings
-
-    def send_listing_email(self, to_email: str, listing: Listing, body: str) -> None:
-        """Send email notification about a new listing."""
+        self._pool: Optional[SMTPPool] = None
+        self._pool_users = 0
+        self._pool_lock = threading.Lock()
+
+    def __enter__(self) -> EmailService:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = SMTPPool(self._connect, self.settings.email_smtp_pool_size)
+            self._pool_users += 1
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        with self._pool_lock:
+            self._pool_users -= 1
+            if self._pool_users:
+                return
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+
+    def build_listing_message(self, listing: Listing, body: str) -> EmailMessage:
+        """Build the recipient-independent alert email for a listing."""
         if not self.settings.email_from_address:
             raise RuntimeError("EMAIL_FROM_ADDRESS must be configured for email alerts.")
         
         subject = f"New Rental Alert: {listing.title}"
-        msg = self._create_message(to_email, subject, body)
-        
-        with self._connect() as smtp:
-            smtp.send_message(msg)
+        return self._create_message(subject, body)
+
+    def send_listing_email(self, to_email: str, template: EmailMessage) -> None:
+        """Send a listing alert built by `build_listing_message` to one recipient."""
+        # A shallow copy shares the already-encoded body; deleting the header
+        # rebinds the copy's header list so the template is never mutated.
+        msg = copy.copy(template)
+        del msg["To"]
+        msg["To"] = to_email
+        self._send(msg)
+
+    def _send(self, msg: EmailMessage) -> None:
+        """Send a message, borrowing a pooled SMTP session when a batch is active."""
+        pool = self._pool
+        if pool is None:
+            with self._connect() as smtp:
+                smtp.send_message(msg)
+            return
 
-    def _create_message(self, to_email: str, subject: str, body: str) -> EmailMessage:
-        """Create an email message with proper headers."""
+        smtp = pool.acquire()
+        try:
+            try:
+                smtp.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                smtp = None
+                smtp = self._connect()
+                smtp.send_message(msg)
+        finally:
+            pool.release(smtp)
+
+    def _create_message(self, subject: str, body: str) -> EmailMessage:
+        """Create an email message with proper headers, leaving `To` unset."""
         msg = EmailMessage()
         msg["Subject"] = subject
         msg["From"] = self.settings.email_from_address
-        msg["To"] = to_email
         
         # Enhanced branding footer
         footer = f"""
@@ -332,10 +567,9 @@ Join 10,000+ renters who found apartments faster
             listing_data.append({
                 "title": listing.title,
                 "price": listing.price,
-                "bedrooms": listing.bedrooms,
-                "location": listing.location,
+                "location": listing.neighborhood,
                 "url": listing.url,
-                "first_seen": listing.first_seen,
+                "first_seen": listing.created_at,
             })
         
         # Render HTML
@@ -355,9 +589,8 @@ Join 10,000+ renters who found apartments faster
         msg.add_alternative(html_content, subtype="html")
         
         # Send
-        with self._connect() as smtp:
-            smtp.send_message(msg)
+        self._send(msg)
 
 
-__all__ = ["AlertService", "_format_message", "EmailService"]
+__all__ = ["AlertService", "_format_message", "EmailService", "SMTPPool"]
 
@@ -1,10 +1,19 @@
 from __future__ import annotations
 
+import base64
 import hashlib
 import os
 import secrets
 from typing import Tuple
 
+# v2 hashes store salt and key as base64; earlier hashes use hex.
+HASH_VERSION = "v2"
+SCRYPT_NAME = "scrypt"
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+KEY_SIZE = 32
+# Legacy PBKDF2 parameters, kept so existing hashes still verify.
 HASH_NAME = "sha256"
 ITERATIONS = 150_000
 SALT_SIZE = 16
@@ -17,42 +26,55 @@ def normalize_email(email: str) -> str:
 
 
 def hash_password(password: str) -> str:
-    """Return a PBKDF2 hashed password."""
+    """Return an scrypt hashed password."""
     salt = os.urandom(SALT_SIZE)
-    key = hashlib.pbkdf2_hmac(HASH_NAME, password.encode("utf-8"), salt, ITERATIONS)
-    return f"{HASH_NAME}${ITERATIONS}${salt.hex()}${key.hex()}"
+    key = hashlib.scrypt(
+        password.encode("utf-8"),
+        salt=salt,
+        n=SCRYPT_N,
+        r=SCRYPT_R,
+        p=SCRYPT_P,
+        dklen=KEY_SIZE,
+    )
+    salt_b64 = base64.b64encode(salt).decode("ascii")
+    key_b64 = base64.b64encode(key).decode("ascii")
+    return f"{HASH_VERSION}${SCRYPT_NAME}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt_b64}${key_b64}"
 
 
-def _parse_hash(encoded: str) -> Tuple[str, int, bytes, bytes]:
-    algorithm, iterations, salt_hex, key_hex = encoded.split("$", 3)
-    return (
-        algorithm,
-        int(iterations),
-        bytes.fromhex(salt_hex),
-        bytes.fromhex(key_hex),
-    )
+def _parse_hash(encoded: str) -> Tuple[str, Tuple[int, ...], bytes, bytes]:
+    version, _, rest = encoded.partition("$")
+    if version == HASH_VERSION:
+        algorithm, *params, salt_b64, key_b64 = rest.split("$")
+        salt = base64.b64decode(salt_b64, validate=True)
+        key = base64.b64decode(key_b64, validate=True)
+    else:
+        algorithm, *params, salt_hex, key_hex = encoded.split("$")
+        salt = bytes.fromhex(salt_hex)
+        key = bytes.fromhex(key_hex)
+    return algorithm, tuple(int(param) for param in params), salt, key
 
 
 def verify_password(password: str, encoded: str) -> bool:
-    """Verify a plaintext password against a stored hash."""
+    """Verify a plaintext password against a stored scrypt or PBKDF2 hash."""
     try:
-        algorithm, iterations, salt, expected_key = _parse_hash(encoded)
+        algorithm, params, salt, expected_key = _parse_hash(encoded)
     except (ValueError, TypeError):
         return False
 
-    if algorithm != HASH_NAME:
+    secret = password.encode("utf-8")
+    try:
+        if algorithm == SCRYPT_NAME and len(params) == 3:
+            n, r, p = params
+            derived = hashlib.scrypt(secret, salt=salt, n=n, r=r, p=p, dklen=len(expected_key))
+        elif algorithm == HASH_NAME and len(params) == 1:
+            derived = hashlib.pbkdf2_hmac(algorithm, secret, salt, params[0])
+        else:
+            return False
+    except ValueError:
         return False
-
-    derived = hashlib.pbkdf2_hmac(
-        algorithm,
-        password.encode("utf-8"),
-        salt,
-        iterations,
-    )
     return secrets.compare_digest(derived, expected_key)
 
 
 def create_session_token() -> str:
-    """Generate a random session token."""
-    return secrets.token_urlsafe(SESSION_TOKEN_BYTES)
-
+    """Generate a random URL-safe session token."""
+    return base64.urlsafe_b64encode(os.urandom(SESSION_TOKEN_BYTES)).rstrip(b"=").decode("ascii")
@@ -2,14 +2,12 @@
 from __future__ import annotations
 
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from functools import lru_cache
 from typing import Optional
 
 from dotenv import load_dotenv
 
-load_dotenv()
-
 
 @dataclass(frozen=True)
 class Settings:
@@ -20,10 +18,12 @@ class Settings:
     scrape_interval_seconds: int
     request_timeout_seconds: int
     max_backoff_seconds: int
+    alert_send_workers: int
     twilio_account_sid: Optional[str]
     twilio_auth_token: Optional[str]
     twilio_from_number: Optional[str]
     twilio_whatsapp_from_number: Optional[str]
+    twilio_whatsapp_content_sid: Optional[str]
     stripe_api_key: Optional[str]
     stripe_price_id_essential: Optional[str]
     stripe_price_id_elite: Optional[str]
@@ -35,55 +35,52 @@ class Settings:
     email_smtp_username: Optional[str]
     email_smtp_password: Optional[str]
     email_from_address: Optional[str]
+    email_smtp_pool_size: int
     admin_api_key: Optional[str]
+    debug: bool
 
-    @property
-    def twilio_configured(self) -> bool:
-        """Return True when all Twilio credentials are present."""
-        return all(
-            [
-                self.twilio_account_sid,
-                self.twilio_auth_token,
-                self.twilio_from_number,
-            ]
-        )
-
-    @property
-    def whatsapp_configured(self) -> bool:
-        """Return True if WhatsApp sending is configured."""
-        return self.twilio_configured and bool(self.twilio_whatsapp_from_number)
+    # Derived flags, computed once in __post_init__ since settings are frozen.
+    twilio_configured: bool = field(init=False)
+    whatsapp_configured: bool = field(init=False)
+    email_configured: bool = field(init=False)
+    stripe_configured: bool = field(init=False)
 
-    @property
-    def email_configured(self) -> bool:
-        """Return True when SMTP email credentials are present."""
-        return all(
-            [
-                self.email_smtp_host,
-                self.email_smtp_port,
-                self.email_from_address,
-            ]
+    def __post_init__(self) -> None:
+        twilio_configured = bool(
+            self.twilio_account_sid and self.twilio_auth_token and self.twilio_from_number
         )
-
-    @property
-    def stripe_configured(self) -> bool:
-        """Return True when Stripe credentials are present."""
-        return all(
-            [
-                self.stripe_api_key,
-                self.stripe_webhook_secret,
-            ]
+        # True when all Twilio credentials are present.
+        object.__setattr__(self, "twilio_configured", twilio_configured)
+        # True if WhatsApp sending is configured.
+        object.__setattr__(
+            self, "whatsapp_configured", twilio_configured and bool(self.twilio_whatsapp_from_number)
+        )
+        # True when SMTP email credentials are present.
+        object.__setattr__(
+            self,
+            "email_configured",
+            bool(self.email_smtp_host and self.email_smtp_port and self.email_from_address),
+        )
+        # True when Stripe credentials are present.
+        object.__setattr__(
+            self, "stripe_configured", bool(self.stripe_api_key and self.stripe_webhook_secret)
         )
 
 
 @lru_cache(maxsize=1)
 def get_settings() -> Settings:
     """Load settings at most once per process."""
-    database_path = os.getenv("DATABASE_PATH", "marketseek.db")
-    target_url = os.getenv("TARGET_URL", "")
-    scrape_interval = int(os.getenv("SCRAPE_INTERVAL_SECONDS", "300"))
-    request_timeout = int(os.getenv("REQUEST_TIMEOUT_SECONDS", "10"))
-    max_backoff = int(os.getenv("MAX_BACKOFF_SECONDS", "120"))
-    user_agent = os.getenv(
+    # Parsing .env happens here rather than at import so importing config stays cheap.
+    load_dotenv()
+    env = dict(os.environ)
+    database_path = env.get("DATABASE_PATH", "marketseek.db")
+    target_url = env.get("TARGET_URL", "")
+    scrape_interval = int(env.get("SCRAPE_INTERVAL_SECONDS", "300"))
+    request_timeout = int(env.get("REQUEST_TIMEOUT_SECONDS", "10"))
+    max_backoff = int(env.get("MAX_BACKOFF_SECONDS", "120"))
+    # Twilio allows 25 messages per second per sender by default.
+    alert_send_workers = int(env.get("ALERT_SEND_WORKERS", "25"))
+    user_agent = env.get(
         "SCRAPER_USER_AGENT",
         (
             "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
@@ -97,20 +94,24 @@ def get_settings() -> Settings:
         scrape_interval_seconds=scrape_interval,
         request_timeout_seconds=request_timeout,
         max_backoff_seconds=max_backoff,
-        twilio_account_sid=os.getenv("TWILIO_ACCOUNT_SID"),
-        twilio_auth_token=os.getenv("TWILIO_AUTH_TOKEN"),
-        twilio_from_number=os.getenv("TWILIO_FROM_NUMBER"),
-        twilio_whatsapp_from_number=os.getenv("TWILIO_WHATSAPP_FROM_NUMBER"),
-        stripe_api_key=os.getenv("STRIPE_API_KEY"),
-        stripe_price_id_essential=os.getenv("STRIPE_PRICE_ID_ESSENTIAL"),
-        stripe_price_id_elite=os.getenv("STRIPE_PRICE_ID_ELITE"),
-        stripe_price_id_lifetime=os.getenv("STRIPE_PRICE_ID_LIFETIME"),
-        stripe_webhook_secret=os.getenv("STRIPE_WEBHOOK_SECRET"),
+        alert_send_workers=max(1, alert_send_workers),
+        twilio_account_sid=env.get("TWILIO_ACCOUNT_SID"),
+        twilio_auth_token=env.get("TWILIO_AUTH_TOKEN"),
+        twilio_from_number=env.get("TWILIO_FROM_NUMBER"),
+        twilio_whatsapp_from_number=env.get("TWILIO_WHATSAPP_FROM_NUMBER"),
+        twilio_whatsapp_content_sid=env.get("TWILIO_WHATSAPP_CONTENT_SID"),
+        stripe_api_key=env.get("STRIPE_API_KEY"),
+        stripe_price_id_essential=env.get("STRIPE_PRICE_ID_ESSENTIAL"),
+        stripe_price_id_elite=env.get("STRIPE_PRICE_ID_ELITE"),
+        stripe_price_id_lifetime=env.get("STRIPE_PRICE_ID_LIFETIME"),
+        stripe_webhook_secret=env.get("STRIPE_WEBHOOK_SECRET"),
         user_agent=user_agent,
-        email_smtp_host=os.getenv("EMAIL_SMTP_HOST"),
-        email_smtp_port=int(os.getenv("EMAIL_SMTP_PORT", "0")) or None,
-        email_smtp_username=os.getenv("EMAIL_SMTP_USERNAME"),
-        email_smtp_password=os.getenv("EMAIL_SMTP_PASSWORD"),
-        email_from_address=os.getenv("EMAIL_FROM_ADDRESS"),
-        admin_api_key=os.getenv("ADMIN_API_KEY", "changeme"),
+        email_smtp_host=env.get("EMAIL_SMTP_HOST"),
+        email_smtp_port=int(env.get("EMAIL_SMTP_PORT", "0")) or None,
+        email_smtp_username=env.get("EMAIL_SMTP_USERNAME"),
+        email_smtp_password=env.get("EMAIL_SMTP_PASSWORD"),
+        email_from_address=env.get("EMAIL_FROM_ADDRESS"),
+        email_smtp_pool_size=max(1, int(env.get("EMAIL_SMTP_POOL_SIZE", "4"))),
+        admin_api_key=env.get("ADMIN_API_KEY", "changeme"),
+        debug=env.get("DEBUG", "").lower() in {"1", "true", "yes"},
     )
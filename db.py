@@ -1,18 +1,27 @@
 from __future__ import annotations
 
+import atexit
+import hashlib
 import logging
+import random
+import re
+import secrets
 import sqlite3
+import threading
+import time
 from contextlib import contextmanager
 from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, wraps
 from pathlib import Path
-from typing import Generator, Iterable, List, Optional, Any
+from typing import Callable, Generator, Iterable, Iterator, List, Optional, Any, TypeVar
 
 from config import get_settings
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
+@dataclass(slots=True)
 class Listing:
     post_id: str
     title: str
@@ -23,7 +32,11 @@ class Listing:
     notified_at: Optional[str] = None
 
 
-@dataclass
+# Listing fields in declaration order, so rows selected with it unpack as Listing(*row).
+_LISTING_COLUMNS = "post_id, title, url, price, neighborhood, created_at, notified_at"
+
+
+@dataclass(slots=True)
 class User:
     id: int
     email: str
@@ -31,7 +44,7 @@ class User:
     created_at: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Subscriber:
     id: int
     tier: str
@@ -51,7 +64,7 @@ class Subscriber:
     lifetime_purchased_at: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Referral:
     id: int
     referrer_code: str
@@ -64,36 +77,243 @@ class Referral:
 
 SETTINGS = get_settings()
 DB_PATH = Path(SETTINGS.database_path)
+_DIR_READY = False
+
+
+# RETURNING (SQLite 3.35+) reports written rows without relying on rowcount.
+_SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Stay below SQLITE_MAX_VARIABLE_NUMBER on older SQLite builds.
+_MAX_SQL_PARAMS = 900
+
+# Rows pulled per fetchmany() call when streaming results.
+_FETCH_PAGE_SIZE = 256
+
+# WAL allows many readers but one writer: each thread keeps a long-lived
+# query-only reader (warm page cache), and all writes share one connection
+# serialized by a lock so they never contend for the write lock among themselves.
+_local = threading.local()
+_writer: Optional[sqlite3.Connection] = None
+_writer_lock = threading.RLock()
+# Readers by owning thread. Threadpool and executor threads come and go, so the
+# readers of threads that have exited are closed whenever a new one is opened.
+_readers: dict[threading.Thread, sqlite3.Connection] = {}
+_readers_lock = threading.Lock()
+
+# Applied once per connection. NORMAL sync is durable under WAL except for the
+# last commits on power loss, and avoids an fsync on every write. Foreign keys
+# are a per-connection setting, so they are enabled here rather than by init_db.
+_CONNECTION_PRAGMAS = """
+PRAGMA foreign_keys=ON;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-64000;
+PRAGMA mmap_size=268435456;
+PRAGMA wal_autocheckpoint=1000;
+"""
+
+
+# Seconds the writer blocks on a locked database per attempt. Scraper and web
+# run as separate processes, so a long migration or bulk insert in one must not
+# crash the other at startup.
+_WRITER_BUSY_TIMEOUT = 5
+
+
+def _ensure_directory_once() -> None:
+    """Create the database directory the first time a connection is opened."""
+    global _DIR_READY
+    if _DIR_READY:
+        return
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    _DIR_READY = True
 
 
-def _ensure_directory(path: Path) -> None:
-    if not path.parent.exists():
-        path.parent.mkdir(parents=True, exist_ok=True)
-
-
-@contextmanager
-def get_connection() -> Generator[sqlite3.Connection, None, None]:
-    """Yield a SQLite connection with sensible defaults."""
-    _ensure_directory(DB_PATH)
+def _connect(*, read_only: bool = False) -> sqlite3.Connection:
+    """Open a SQLite connection with sensible defaults."""
+    _ensure_directory_once()
     conn = sqlite3.connect(
         DB_PATH,
-        detect_types=sqlite3.PARSE_DECLTYPES,
+        # Timestamps stay ISO strings, matching the Optional[str] dataclass fields.
+        detect_types=0,
         check_same_thread=False,
         isolation_level=None,
-        timeout=30,
+        # The writer waits only briefly inside SQLite, then backs off in Python
+        # (see _retry_on_busy); across retries that still tolerates a lock held
+        # for about as long as the former 30s timeout.
+        timeout=30 if read_only else _WRITER_BUSY_TIMEOUT,
+        cached_statements=256,
     )
+    conn.create_function("parse_price_cents", 1, _parse_price_cents, deterministic=True)
+    # WAL is a persistent property of the database file; in-memory databases
+    # cannot use it, so they keep their default journal.
+    if str(DB_PATH) != ":memory:":
+        conn.execute("PRAGMA journal_mode=WAL;")
+    conn.executescript(_CONNECTION_PRAGMAS)
+    if read_only:
+        conn.execute("PRAGMA query_only=1;")
+    return conn
+
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+# Attempts made by _retry_on_busy before a "database is locked" error propagates.
+_BUSY_RETRIES = 6
+
+
+def _retry_on_busy(func: _F) -> _F:
+    """Retry a write function with exponential backoff while another process holds the write lock."""
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        for attempt in range(_BUSY_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as exc:
+                if "locked" not in str(exc) or attempt == _BUSY_RETRIES - 1:
+                    raise
+                time.sleep(min(0.05 * 2 ** attempt, 1.0) + random.random() * 0.01)
+    return wrapper  # type: ignore[return-value]
+
+
+# Bumped by every write so _ttl_cache results from before it are discarded.
+_cache_epoch = 0
+
+
+def _ttl_cache(ttl: float, maxsize: Optional[int] = None) -> Callable[[_F], _F]:
+    """Cache a read-only query's result per arguments for ttl seconds or until the next write.
+
+    With maxsize set, a full cache first drops its expired entries and, failing
+    that, starts over empty.
+    """
+    def decorator(func: _F) -> _F:
+        cache: dict[tuple, tuple[float, int, Any]] = {}
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            entry = cache.get(key)
+            if entry is not None and entry[0] > now and entry[1] == _cache_epoch:
+                return entry[2]
+            epoch = _cache_epoch
+            result = func(*args, **kwargs)
+            with lock:
+                if maxsize is not None and len(cache) >= maxsize and key not in cache:
+                    for stale in [k for k, v in cache.items() if v[0] <= now or v[1] != _cache_epoch]:
+                        del cache[stale]
+                    if len(cache) >= maxsize:
+                        cache.clear()
+                cache[key] = (now + ttl, epoch, result)
+            return result
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+# Dashboard reference data changes on a scale of minutes; the neighborhood
+# set changes more slowly still, so it may lag the scraper for longer.
+_REFERENCE_TTL_SECONDS = 30
+_NEIGHBORHOOD_TTL_SECONDS = 300
+# Session lookups run on every authenticated page. Logging out deletes the
+# session, and that write drops the cached entries. The size bound keeps
+# arbitrary cookie values from growing the cache without limit. This assumes a
+# single web worker: the cache is per process, so with several uvicorn workers
+# a logged-out session keeps authenticating in the others for up to the TTL.
+# Move sessions to a shared store (e.g. Memcached) before scaling out.
+_SESSION_TTL_SECONDS = 60
+_SESSION_CACHE_SIZE = 10_000
+
+
+@contextmanager
+def _txn(conn: sqlite3.Connection) -> Generator[sqlite3.Connection, None, None]:
+    """Run a block of writes as one IMMEDIATE transaction with a single commit."""
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        conn.row_factory = sqlite3.Row
         yield conn
-    finally:
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _execute_write(conn: sqlite3.Connection, query: str, params: Any, returning: str) -> bool:
+    """Run a single-row write and report whether a row was written."""
+    if _SUPPORTS_RETURNING:
+        return conn.execute(f"{query} RETURNING {returning};", params).fetchone() is not None
+    return conn.execute(f"{query};", params).rowcount > 0
+
+
+@contextmanager
+def get_connection() -> Generator[sqlite3.Connection, None, None]:
+    """Yield the calling thread's persistent read-only SQLite connection."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect(read_only=True)
+        with _readers_lock:
+            finished = [thread for thread in _readers if not thread.is_alive()]
+            stale = [_readers.pop(thread) for thread in finished]
+            _readers[threading.current_thread()] = conn
+        for reader in stale:
+            reader.close()
+    yield conn
+
+
+@contextmanager
+def write_connection() -> Generator[sqlite3.Connection, None, None]:
+    """Yield the shared writer connection, held exclusively for the block."""
+    global _writer, _cache_epoch
+    with _writer_lock:
+        if _writer is None:
+            _writer = _connect()
+        try:
+            yield _writer
+        finally:
+            # Any local write may change a cached read; other processes' writes age out via the TTL.
+            _cache_epoch += 1
+
+
+def close_connections() -> None:
+    """Close every connection opened by this module."""
+    global _local, _writer
+    with _writer_lock, _readers_lock:
+        connections = list(_readers.values())
+        _readers.clear()
+        # Fresh thread-local storage so no thread keeps a closed connection.
+        writer = _writer
+        _local = threading.local()
+        _writer = None
+    if writer is not None:
+        # Refreshes planner statistics for indexes whose tables changed this session.
+        try:
+            writer.execute("PRAGMA optimize;")
+        except sqlite3.Error:
+            logger.warning("PRAGMA optimize failed on close", exc_info=True)
+        writer.close()
+    for conn in connections:
         conn.close()
 
 
+atexit.register(close_connections)
+
+
+def reset_connections() -> None:
+    """Close all connections and re-read the database path from current settings."""
+    global SETTINGS, DB_PATH, _DIR_READY, _cache_epoch
+    close_connections()
+    SETTINGS = get_settings()
+    DB_PATH = Path(SETTINGS.database_path)
+    _DIR_READY = False
+    _cache_epoch += 1
+
+
+# Bump whenever init_db gains a migration so existing databases pick it up.
+SCHEMA_VERSION = 9
+
+
+@_retry_on_busy
 def init_db() -> None:
-    """Create required tables if they do not exist."""
+    """Create required tables and run migrations unless the schema is current."""
     schema = """
-    PRAGMA journal_mode=WAL;
-    PRAGMA foreign_keys = ON;
+    BEGIN IMMEDIATE;
 
     CREATE TABLE IF NOT EXISTS listings (
         post_id TEXT PRIMARY KEY,
@@ -102,9 +322,17 @@ def init_db() -> None:
         neighborhood TEXT,
         url TEXT NOT NULL,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        notified_at TIMESTAMP
+        notified_at TIMESTAMP,
+        price_cents INTEGER
     );
 
+    CREATE INDEX IF NOT EXISTS idx_listings_unnotified ON listings(created_at) WHERE notified_at IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_listings_created ON listings(created_at DESC);
+    CREATE INDEX IF NOT EXISTS idx_listings_neighborhood
+        ON listings(neighborhood COLLATE NOCASE) WHERE neighborhood IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_listings_neighborhood_created
+        ON listings(neighborhood, created_at) WHERE neighborhood IS NOT NULL;
+
     CREATE TABLE IF NOT EXISTS subscribers (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         phone TEXT UNIQUE,
@@ -137,6 +365,8 @@ def init_db() -> None:
         FOREIGN KEY (referrer_code) REFERENCES subscribers(referral_code)
     );
 
+    CREATE INDEX IF NOT EXISTS idx_referrals_code ON referrals(referrer_code, reward_granted);
+
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         email TEXT NOT NULL UNIQUE,
@@ -150,46 +380,125 @@ def init_db() -> None:
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
     );
+
+    -- Covers session lookups so resolving a token never reads the sessions table.
+    CREATE INDEX IF NOT EXISTS idx_sessions_token_user ON sessions(token, user_id);
     """
 
-    with get_connection() as conn:
-        conn.executescript(schema)
-        _ensure_subscriber_schema(conn)
+    with write_connection() as conn:
+        if conn.execute("PRAGMA user_version;").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        # executescript commits any open transaction, so the script opens its
+        # own and the column migrations join it before a single COMMIT.
+        try:
+            conn.executescript(schema)
+            _ensure_listings_schema(conn)
+            _ensure_subscriber_schema(conn)
+            _ensure_referral_schema(conn)
+            _ensure_row_counters(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def _ensure_listings_schema(conn: sqlite3.Connection) -> None:
+    """Ensure listings table has expected columns and indexes; runs inside init_db's transaction."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(listings);")}
+    if "price_cents" not in columns:
+        conn.execute("ALTER TABLE listings ADD COLUMN price_cents INTEGER;")
+        conn.execute("UPDATE listings SET price_cents = parse_price_cents(price) WHERE price IS NOT NULL;")
+
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_listings_price_cents ON listings(price_cents) WHERE price_cents IS NOT NULL;"
+    )
+
+
+def _ensure_referral_schema(conn: sqlite3.Connection) -> None:
+    """Keep one referral per referrer and referee; runs inside init_db's transaction."""
+    # Older databases may already hold duplicates; keep the rewarded (or earliest) row.
+    conn.execute(
+        """
+        DELETE FROM referrals WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY referrer_code, referee_email ORDER BY reward_granted DESC, id
+                ) AS rank
+                FROM referrals
+            )
+            WHERE rank > 1
+        );
+        """
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_referrals_pair ON referrals(referrer_code, referee_email);"
+    )
+
+
+def _ensure_row_counters(conn: sqlite3.Connection) -> None:
+    """Maintain trigger-driven row counts so count lookups avoid COUNT(*) scans."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0);"
+    )
+    for table in ("listings", "subscribers"):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_count_insert AFTER INSERT ON {table}
+            BEGIN UPDATE counters SET value = value + 1 WHERE name = '{table}'; END;
+            """
+        )
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_count_delete AFTER DELETE ON {table}
+            BEGIN UPDATE counters SET value = value - 1 WHERE name = '{table}'; END;
+            """
+        )
+        # Reseed from the table itself; this runs in the same transaction as the triggers.
+        conn.execute(
+            f"INSERT OR REPLACE INTO counters (name, value) SELECT '{table}', COUNT(*) FROM {table};"
+        )
+
+
+# Columns added to subscribers after the original schema, with their ALTER definitions.
+_SUBSCRIBER_COLUMNS: List[tuple[str, str]] = [
+    ("email", "TEXT"),
+    ("whatsapp", "TEXT"),
+    ("channel_preferences", "TEXT NOT NULL DEFAULT 'sms'"),
+    ("tier", "TEXT NOT NULL DEFAULT 'FREE'"),
+    ("email_verified", "INTEGER DEFAULT 0"),
+    ("verification_token", "TEXT"),
+    ("trial_ends_at", "TIMESTAMP"),
+    ("subscription_credits", "INTEGER DEFAULT 0"),
+    # SQLite cannot add a UNIQUE column; uniqueness comes from an index below.
+    ("referral_code", "TEXT"),
+    ("referred_by", "TEXT"),
+    ("successful_referrals", "INTEGER DEFAULT 0"),
+    ("whatsapp_unlocked", "INTEGER DEFAULT 0"),
+    ("last_digest_sent", "TIMESTAMP"),
+    ("is_lifetime", "INTEGER DEFAULT 0"),
+    ("lifetime_purchased_at", "TIMESTAMP"),
+]
 
 
 def _ensure_subscriber_schema(conn: sqlite3.Connection) -> None:
-    """Ensure subscriber table has expected columns and indexes."""
-    columns = {row["name"] for row in conn.execute("PRAGMA table_info(subscribers);")}
-    if "email" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN email TEXT;")
-    if "whatsapp" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN whatsapp TEXT;")
-    if "channel_preferences" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN channel_preferences TEXT NOT NULL DEFAULT 'sms';")
-    if "tier" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN tier TEXT NOT NULL DEFAULT 'FREE';")
-    if "email_verified" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN email_verified INTEGER DEFAULT 0;")
-    if "verification_token" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN verification_token TEXT;")
-    if "trial_ends_at" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN trial_ends_at TIMESTAMP;")
-    if "subscription_credits" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN subscription_credits INTEGER DEFAULT 0;")
-    if "referral_code" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN referral_code TEXT UNIQUE;")
-    if "referred_by" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN referred_by TEXT;")
-    if "successful_referrals" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN successful_referrals INTEGER DEFAULT 0;")
-    if "whatsapp_unlocked" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN whatsapp_unlocked INTEGER DEFAULT 0;")
-    if "last_digest_sent" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN last_digest_sent TIMESTAMP;")
-    if "is_lifetime" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN is_lifetime INTEGER DEFAULT 0;")
-    if "lifetime_purchased_at" not in columns:
-        conn.execute("ALTER TABLE subscribers ADD COLUMN lifetime_purchased_at TIMESTAMP;")
+    """Ensure subscriber table has expected columns and indexes; runs inside init_db's transaction."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(subscribers);")}
+    missing = [(name, ddl) for name, ddl in _SUBSCRIBER_COLUMNS if name not in columns]
+    for name, ddl in missing:
+        conn.execute(f"ALTER TABLE subscribers ADD COLUMN {name} {ddl};")
+    # referrals.referrer_code references this column, and a foreign key parent
+    # key needs a unique index without a WHERE clause (NULL codes stay distinct).
+    # Earlier migrations built a partial one, so it is rebuilt.
+    code_index = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND name = 'idx_subscribers_referral_code';"
+    ).fetchone()
+    partial = code_index is not None and " WHERE " in code_index[0].upper()
+    if partial:
+        conn.execute("DROP INDEX idx_subscribers_referral_code;")
+    if partial or "referral_code" not in columns:
+        conn.execute("CREATE UNIQUE INDEX idx_subscribers_referral_code ON subscribers(referral_code);")
 
     conn.execute(
         "CREATE UNIQUE INDEX IF NOT EXISTS idx_subscribers_phone ON subscribers(phone) WHERE phone IS NOT NULL;"
@@ -200,6 +509,13 @@ def _ensure_subscriber_schema(conn: sqlite3.Connection) -> None:
     conn.execute(
         "CREATE UNIQUE INDEX IF NOT EXISTS idx_subscribers_whatsapp ON subscribers(whatsapp) WHERE whatsapp IS NOT NULL;"
     )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_subscribers_digest ON subscribers(last_digest_sent) "
+        "WHERE tier = 'FREE' AND email IS NOT NULL;"
+    )
+    if not missing:
+        return
+    # Backfill defaults only when columns were just added to a legacy table.
     conn.execute(
         "UPDATE subscribers SET channel_preferences = 'sms' WHERE channel_preferences IS NULL OR TRIM(channel_preferences) = '';"
     )
@@ -207,33 +523,100 @@ def _ensure_subscriber_schema(conn: sqlite3.Connection) -> None:
     conn.execute("UPDATE subscribers SET email_verified = 0 WHERE email_verified IS NULL;")
 
 
+_PRICE_NUMBER_RE = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def _parse_price_cents(price: Optional[str]) -> Optional[int]:
+    """Parse a display price such as "$1,200" into integer cents."""
+    if not price:
+        return None
+    match = _PRICE_NUMBER_RE.search(price)
+    if not match:
+        return None
+    return round(float(match.group().replace(",", "")) * 100)
+
+
+@_retry_on_busy
 def insert_listing(listing: Listing) -> bool:
     """Insert a listing if new. Returns True when inserted."""
     query = """
-    INSERT OR IGNORE INTO listings (post_id, title, price, neighborhood, url)
-    VALUES (:post_id, :title, :price, :neighborhood, :url);
+    INSERT OR IGNORE INTO listings (post_id, title, price, neighborhood, url, price_cents)
+    VALUES (?, ?, ?, ?, ?, ?)
     """
-    with get_connection() as conn:
-        cursor = conn.execute(
+    with write_connection() as conn:
+        inserted = _execute_write(
+            conn,
             query,
-            {
-                "post_id": listing.post_id,
-                "title": listing.title,
-                "price": listing.price,
-                "neighborhood": listing.neighborhood,
-                "url": listing.url,
-            },
+            (
+                listing.post_id,
+                listing.title,
+                listing.price,
+                listing.neighborhood,
+                listing.url,
+                _parse_price_cents(listing.price),
+            ),
+            "post_id",
         )
-        inserted = cursor.rowcount > 0
     if inserted:
         logger.info("Inserted new listing", extra={"post_id": listing.post_id})
     return inserted
 
 
-def list_unnotified_listings(limit: Optional[int] = 50) -> List[Listing]:
-    """Return listings that have not yet triggered alerts."""
-    base_query = """
-    SELECT post_id, title, price, neighborhood, url, created_at, notified_at
+def bulk_insert_listings(listings: Iterable[Listing]) -> List[Listing]:
+    """Insert new listings in one transaction. Returns the listings that were new."""
+    # First occurrence wins, matching INSERT OR IGNORE within a batch. The input
+    # may be a one-shot iterator, so it is drained here, outside the busy retry.
+    candidates: dict[str, Listing] = {}
+    for listing in listings:
+        candidates.setdefault(listing.post_id, listing)
+    if not candidates:
+        return []
+    return _insert_new_listings(candidates)
+
+
+@_retry_on_busy
+def _insert_new_listings(candidates: dict[str, Listing]) -> List[Listing]:
+    """Insert the listings whose post_id is not stored yet, keyed by post_id."""
+    query = """
+    INSERT OR IGNORE INTO listings (post_id, title, price, neighborhood, url, price_cents)
+    VALUES (?, ?, ?, ?, ?, ?);
+    """
+    post_ids = list(candidates)
+    existing: set[str] = set()
+    with write_connection() as conn, _txn(conn):
+        for start in range(0, len(post_ids), _MAX_SQL_PARAMS):
+            chunk = post_ids[start:start + _MAX_SQL_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            existing.update(
+                post_id
+                for (post_id,) in conn.execute(
+                    f"SELECT post_id FROM listings WHERE post_id IN ({placeholders});", chunk
+                )
+            )
+        new_listings = [listing for post_id, listing in candidates.items() if post_id not in existing]
+        conn.executemany(
+            query,
+            [
+                (
+                    listing.post_id,
+                    listing.title,
+                    listing.price,
+                    listing.neighborhood,
+                    listing.url,
+                    _parse_price_cents(listing.price),
+                )
+                for listing in new_listings
+            ],
+        )
+    if new_listings:
+        logger.info("Inserted new listings", extra={"count": len(new_listings)})
+    return new_listings
+
+
+def iter_unnotified_listings(limit: Optional[int] = None) -> Iterator[Listing]:
+    """Yield listings that have not yet triggered alerts, one page of rows at a time."""
+    base_query = f"""
+    SELECT {_LISTING_COLUMNS}
     FROM listings
     WHERE notified_at IS NULL
     ORDER BY created_at ASC
@@ -243,35 +626,63 @@ def list_unnotified_listings(limit: Optional[int] = 50) -> List[Listing]:
         base_query += " LIMIT ?;"
         params = (limit,)
     with get_connection() as conn:
-        rows = conn.execute(base_query, params).fetchall()
-    return [
-        Listing(
-            post_id=row["post_id"],
-            title=row["title"],
-            price=row["price"],
-            neighborhood=row["neighborhood"],
-            url=row["url"],
-            created_at=row["created_at"],
-            notified_at=row["notified_at"],
-        )
-        for row in rows
-    ]
+        cursor = conn.execute(base_query, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(_FETCH_PAGE_SIZE)
+                if not rows:
+                    return
+                for row in rows:
+                    yield Listing(*row)
+        finally:
+            cursor.close()
 
 
+def list_unnotified_listings(limit: Optional[int] = 50) -> List[Listing]:
+    """Return listings that have not yet triggered alerts."""
+    return list(iter_unnotified_listings(limit))
+
+
+@_retry_on_busy
 def mark_listings_notified(post_ids: Iterable[str]) -> None:
     """Set notified_at for the provided listings."""
     post_ids = list(post_ids)
     if not post_ids:
         return
-    query = """
-    UPDATE listings
-    SET notified_at = CURRENT_TIMESTAMP
-    WHERE post_id = ?;
+    with write_connection() as conn, _txn(conn):
+        for start in range(0, len(post_ids), _MAX_SQL_PARAMS):
+            chunk = post_ids[start:start + _MAX_SQL_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            conn.execute(
+                f"UPDATE listings SET notified_at = CURRENT_TIMESTAMP WHERE post_id IN ({placeholders});",
+                chunk,
+            )
+
+
+# One static statement per conflict target. The WHERE clause lets the target
+# match the partial unique indexes, which are the only ones on migrated tables.
+_UPSERT_SUBSCRIBER_SQL = {
+    field: f"""
+    INSERT INTO subscribers (phone, email, whatsapp, channel_preferences, tier)
+    VALUES (:phone, :email, :whatsapp, :channel_preferences, :tier)
+    ON CONFLICT({field}) WHERE {field} IS NOT NULL DO UPDATE SET
+        phone = :phone,
+        email = :email,
+        whatsapp = :whatsapp,
+        channel_preferences = :channel_preferences,
+        tier = :tier
     """
-    with get_connection() as conn:
-        conn.executemany(query, [(post_id,) for post_id in post_ids])
+    for field in ("phone", "email", "whatsapp")
+}
 
 
+@lru_cache(maxsize=64)
+def _channel_string(channels: tuple[str, ...]) -> str:
+    """Normalize channel names into the stored sorted, comma-separated form."""
+    return ",".join(sorted({channel.strip().lower() for channel in channels if channel})) or "sms"
+
+
+@_retry_on_busy
 def upsert_subscriber(
     *,
     tier: str,
@@ -281,7 +692,7 @@ def upsert_subscriber(
     whatsapp: Optional[str] = None,
 ) -> bool:
     """Insert or update a subscriber record."""
-    channel_string = ",".join(sorted({channel.strip().lower() for channel in channels if channel})) or "sms"
+    channel_string = _channel_string(tuple(channels))
     data = {
         "phone": phone,
         "email": email,
@@ -290,28 +701,18 @@ def upsert_subscriber(
         "tier": tier,
     }
 
-    conflict_field = None
-    conflict_value = None
     if phone:
-        conflict_field, conflict_value = "phone", phone
+        conflict_field = "phone"
     elif email:
-        conflict_field, conflict_value = "email", email
+        conflict_field = "email"
     elif whatsapp:
-        conflict_field, conflict_value = "whatsapp", whatsapp
-
-    if conflict_field is None:
+        conflict_field = "whatsapp"
+    else:
         logger.error("Cannot upsert subscriber without a unique contact method.")
         return False
 
-    placeholders = ", ".join([f"{key} = :{key}" for key in data.keys()])
-    query = f"""
-    INSERT INTO subscribers (phone, email, whatsapp, channel_preferences, tier)
-    VALUES (:phone, :email, :whatsapp, :channel_preferences, :tier)
-    ON CONFLICT({conflict_field}) DO UPDATE SET {placeholders};
-    """
-    with get_connection() as conn:
-        cursor = conn.execute(query, data)
-        updated = cursor.rowcount > 0
+    with write_connection() as conn:
+        updated = _execute_write(conn, _UPSERT_SUBSCRIBER_SQL[conflict_field], data, "id")
 
     if updated:
         logger.info(
@@ -323,48 +724,45 @@ def upsert_subscriber(
 
 def get_all_subscribers() -> List[Subscriber]:
     """Return all subscribers with their preferences."""
+    # Columns follow Subscriber's field order for positional construction; the
+    # defaults and whitespace cleanup happen in SQL so rows only need a split.
     query = """
-    SELECT id, phone, email, whatsapp, channel_preferences, tier, created_at
+    SELECT
+        id,
+        COALESCE(tier, 'FREE'),
+        COALESCE(NULLIF(REPLACE(channel_preferences, ' ', ''), ''), 'sms'),
+        phone,
+        email,
+        whatsapp,
+        created_at
     FROM subscribers;
     """
     with get_connection() as conn:
         rows = conn.execute(query).fetchall()
-    subscribers: List[Subscriber] = []
-    for row in rows:
-        channels = [channel.strip() for channel in (row["channel_preferences"] or "").split(",") if channel.strip()]
-        if not channels:
-            channels = ["sms"]
-        subscribers.append(
-            Subscriber(
-                id=row["id"],
-                tier=row["tier"] or "FREE",
-                channel_preferences=channels,
-                phone=row["phone"],
-                email=row["email"],
-                whatsapp=row["whatsapp"],
-                created_at=row["created_at"],
-            )
-        )
-    return subscribers
+    return [
+        Subscriber(id_, tier, channels.split(","), phone, email, whatsapp, created_at)
+        for id_, tier, channels, phone, email, whatsapp, created_at in rows
+    ]
 
 
+@_ttl_cache(_REFERENCE_TTL_SECONDS)
 def get_subscriber_count() -> int:
     """Return count of subscribers."""
-    query = "SELECT COUNT(*) FROM subscribers;"
+    query = "SELECT value FROM counters WHERE name = 'subscribers';"
     with get_connection() as conn:
         result = conn.execute(query).fetchone()
     return int(result[0]) if result else 0
 
 
+@_retry_on_busy
 def insert_user(email: str, password_hash: str) -> bool:
     """Insert a new user with hashed password."""
     query = """
     INSERT OR IGNORE INTO users (email, password_hash)
-    VALUES (?, ?);
+    VALUES (?, ?)
     """
-    with get_connection() as conn:
-        cursor = conn.execute(query, (email, password_hash))
-        inserted = cursor.rowcount > 0
+    with write_connection() as conn:
+        inserted = _execute_write(conn, query, (email, password_hash), "id")
     if inserted:
         logger.info("Created user", extra={"email": email})
     return inserted
@@ -381,12 +779,7 @@ def get_user_by_email(email: str) -> Optional[User]:
         row = conn.execute(query, (email,)).fetchone()
     if not row:
         return None
-    return User(
-        id=row["id"],
-        email=row["email"],
-        password_hash=row["password_hash"],
-        created_at=row["created_at"],
-    )
+    return User(*row)
 
 
 def get_user_by_id(user_id: int) -> Optional[User]:
@@ -400,29 +793,26 @@ def get_user_by_id(user_id: int) -> Optional[User]:
         row = conn.execute(query, (user_id,)).fetchone()
     if not row:
         return None
-    return User(
-        id=row["id"],
-        email=row["email"],
-        password_hash=row["password_hash"],
-        created_at=row["created_at"],
-    )
+    return User(*row)
 
 
+@_retry_on_busy
 def create_session(user_id: int, token: str) -> None:
     """Persist a session token for a user."""
     query = """
     INSERT OR REPLACE INTO sessions (token, user_id)
     VALUES (?, ?);
     """
-    with get_connection() as conn:
+    with write_connection() as conn:
         conn.execute(query, (token, user_id))
 
 
+@_ttl_cache(_SESSION_TTL_SECONDS, maxsize=_SESSION_CACHE_SIZE)
 def get_user_by_session(token: str) -> Optional[User]:
     """Return the user associated with a session token."""
     query = """
     SELECT u.id, u.email, u.password_hash, u.created_at
-    FROM sessions s
+    FROM sessions s INDEXED BY idx_sessions_token_user
     JOIN users u ON u.id = s.user_id
     WHERE s.token = ?;
     """
@@ -430,43 +820,29 @@ def get_user_by_session(token: str) -> Optional[User]:
         row = conn.execute(query, (token,)).fetchone()
     if not row:
         return None
-    return User(
-        id=row["id"],
-        email=row["email"],
-        password_hash=row["password_hash"],
-        created_at=row["created_at"],
-    )
+    return User(*row)
 
 
+@_retry_on_busy
 def delete_session(token: str) -> None:
     """Delete a session token."""
     query = "DELETE FROM sessions WHERE token = ?;"
-    with get_connection() as conn:
+    with write_connection() as conn:
         conn.execute(query, (token,))
 
 
+@_ttl_cache(_REFERENCE_TTL_SECONDS)
 def get_recent_listings(limit: int = 20) -> List[Listing]:
     """Return recent listings ordered by newest first."""
-    query = """
-    SELECT post_id, title, price, neighborhood, url, created_at, notified_at
+    query = f"""
+    SELECT {_LISTING_COLUMNS}
     FROM listings
-    ORDER BY datetime(created_at) DESC
+    ORDER BY created_at DESC
     LIMIT ?;
     """
     with get_connection() as conn:
         rows = conn.execute(query, (limit,)).fetchall()
-    return [
-        Listing(
-            post_id=row["post_id"],
-            title=row["title"],
-            price=row["price"],
-            neighborhood=row["neighborhood"],
-            url=row["url"],
-            created_at=row["created_at"],
-            notified_at=row["notified_at"],
-        )
-        for row in rows
-    ]
+    return [Listing(*row) for row in rows]
 
 
 def get_filtered_listings(
@@ -481,32 +857,33 @@ def get_filtered_listings(
     conditions = []
     params = []
     
-    # Price filtering - extract numbers from price strings
+    # Price filtering - whole-dollar bounds against the indexed cents column
     if min_price is not None:
-        conditions.append("CAST(REPLACE(REPLACE(REPLACE(price, '$', ''), ',', ''), ' ', '') AS INTEGER) >= ?")
-        params.append(min_price)
+        conditions.append("price_cents >= ?")
+        params.append(min_price * 100)
     
     if max_price is not None:
-        conditions.append("CAST(REPLACE(REPLACE(REPLACE(price, '$', ''), ',', ''), ' ', '') AS INTEGER) <= ?")
-        params.append(max_price)
+        conditions.append("price_cents <= ?")
+        params.append(max_price * 100)
     
     # Neighborhood filtering
     if neighborhood:
-        conditions.append("LOWER(neighborhood) = LOWER(?)")
+        conditions.append("neighborhood = ? COLLATE NOCASE")
         params.append(neighborhood)
     
     # Keyword search in title
     if keyword:
-        conditions.append("LOWER(title) LIKE LOWER(?)")
+        # LIKE already ignores ASCII case, so the column stays unwrapped.
+        conditions.append("title LIKE ?")
         params.append(f"%{keyword}%")
     
     where_clause = " AND ".join(conditions) if conditions else "1=1"
     
     query = f"""
-    SELECT post_id, title, price, neighborhood, url, created_at, notified_at
+    SELECT {_LISTING_COLUMNS}
     FROM listings
     WHERE {where_clause}
-    ORDER BY datetime(created_at) DESC
+    ORDER BY created_at DESC
     LIMIT ?;
     """
     
@@ -515,42 +892,35 @@ def get_filtered_listings(
     with get_connection() as conn:
         rows = conn.execute(query, tuple(params)).fetchall()
     
-    return [
-        Listing(
-            post_id=row["post_id"],
-            title=row["title"],
-            price=row["price"],
-            neighborhood=row["neighborhood"],
-            url=row["url"],
-            created_at=row["created_at"],
-            notified_at=row["notified_at"],
-        )
-        for row in rows
-    ]
+    return [Listing(*row) for row in rows]
 
 
+@_ttl_cache(_REFERENCE_TTL_SECONDS)
 def get_listing_count() -> int:
     """Return total number of listings stored."""
-    query = "SELECT COUNT(*) FROM listings;"
+    query = "SELECT value FROM counters WHERE name = 'listings';"
     with get_connection() as conn:
         result = conn.execute(query).fetchone()
     return int(result[0]) if result else 0
 
 
+@_ttl_cache(_NEIGHBORHOOD_TTL_SECONDS)
 def get_unique_neighborhoods(limit: int = 6) -> List[str]:
     """Return a sample of distinct neighborhoods."""
     query = """
-    SELECT DISTINCT neighborhood
+    SELECT neighborhood, MAX(created_at) AS last_seen
     FROM listings
     WHERE neighborhood IS NOT NULL AND neighborhood != ''
-    ORDER BY created_at DESC
+    GROUP BY neighborhood
+    ORDER BY last_seen DESC
     LIMIT ?;
     """
     with get_connection() as conn:
         rows = conn.execute(query, (limit,)).fetchall()
-    return [row["neighborhood"] for row in rows if row["neighborhood"]]
+    return [row[0] for row in rows if row[0]]
 
 
+@_ttl_cache(_NEIGHBORHOOD_TTL_SECONDS)
 def get_all_neighborhoods() -> List[str]:
     """Return all unique neighborhoods sorted alphabetically."""
     query = """
@@ -561,9 +931,10 @@ def get_all_neighborhoods() -> List[str]:
     """
     with get_connection() as conn:
         rows = conn.execute(query).fetchall()
-    return [row["neighborhood"] for row in rows if row["neighborhood"]]
+    return [row[0] for row in rows if row[0]]
 
 
+@_retry_on_busy
 def set_verification_token(email: str, token: str) -> bool:
     """Set verification token for a subscriber email."""
     query = """
@@ -571,22 +942,22 @@ def set_verification_token(email: str, token: str) -> bool:
     SET verification_token = ?, email_verified = 0
     WHERE email = ?;
     """
-    with get_connection() as conn:
+    with write_connection() as conn:
         cursor = conn.execute(query, (token, email))
         updated = cursor.rowcount > 0
     return updated
 
 
+@_retry_on_busy
 def verify_email(token: str) -> bool:
     """Verify an email using the verification token."""
     query = """
     UPDATE subscribers
     SET email_verified = 1, verification_token = NULL
-    WHERE verification_token = ? AND email_verified = 0;
+    WHERE verification_token = ? AND email_verified = 0
     """
-    with get_connection() as conn:
-        cursor = conn.execute(query, (token,))
-        updated = cursor.rowcount > 0
+    with write_connection() as conn:
+        updated = _execute_write(conn, query, (token,), "id")
     if updated:
         logger.info("Email verified successfully", extra={"token": token[:8]})
     return updated
@@ -595,7 +966,7 @@ def verify_email(token: str) -> bool:
 def get_subscriber_by_email(email: str) -> Optional[Subscriber]:
     """Fetch a subscriber by email."""
     query = """
-    SELECT id, phone, email, whatsapp, channel_preferences, tier, created_at,
+    SELECT id, tier, channel_preferences, phone, email, whatsapp, created_at,
            trial_ends_at, subscription_credits, referral_code, referred_by
     FROM subscribers
     WHERE email = ?;
@@ -605,54 +976,63 @@ def get_subscriber_by_email(email: str) -> Optional[Subscriber]:
     if not row:
         return None
     
-    channels = [channel.strip() for channel in (row["channel_preferences"] or "").split(",") if channel.strip()]
+    (
+        id_, tier, channel_preferences, phone, email, whatsapp, created_at,
+        trial_ends_at, subscription_credits, referral_code, referred_by,
+    ) = row
+    channels = [channel.strip() for channel in (channel_preferences or "").split(",") if channel.strip()]
     if not channels:
         channels = ["email"]
     
     return Subscriber(
-        id=row["id"],
-        tier=row["tier"] or "FREE",
-        channel_preferences=channels,
-        phone=row["phone"],
-        email=row["email"],
-        whatsapp=row["whatsapp"],
-        created_at=row["created_at"],
-        trial_ends_at=row["trial_ends_at"],
-        subscription_credits=row["subscription_credits"] or 0,
-        referral_code=row["referral_code"],
-        referred_by=row["referred_by"],
+        id_,
+        tier or "FREE",
+        channels,
+        phone,
+        email,
+        whatsapp,
+        created_at,
+        trial_ends_at,
+        subscription_credits or 0,
+        referral_code,
+        referred_by,
     )
 
 
 def generate_referral_code(email: str) -> str:
     """Generate a unique referral code for a user."""
-    import hashlib
-    import secrets
     # Create a deterministic but unique code based on email + random salt
-    salt = secrets.token_hex(4)
-    base = f"{email}{salt}"
-    code = hashlib.sha256(base.encode()).hexdigest()[:8].upper()
+    salt = secrets.token_bytes(4).hex()
+    code = hashlib.sha256(f"{email}{salt}".encode()).digest()[:4].hex().upper()
     return f"MS{code}"
 
 
+@_retry_on_busy
 def set_referral_code(email: str) -> Optional[str]:
-    """Generate and set a referral code for a subscriber."""
+    """Generate and set a referral code for a subscriber, returning any existing code."""
+    query = """
+    UPDATE subscribers
+    SET referral_code = ?
+    WHERE email = ? AND referral_code IS NULL;
+    """
     max_attempts = 10
-    for _ in range(max_attempts):
-        code = generate_referral_code(email)
-        query = """
-        UPDATE subscribers
-        SET referral_code = ?
-        WHERE email = ? AND referral_code IS NULL;
-        """
-        with get_connection() as conn:
-            cursor = conn.execute(query, (code, email))
+    with write_connection() as conn:
+        for _ in range(max_attempts):
+            code = generate_referral_code(email)
+            try:
+                cursor = conn.execute(query, (code, email))
+            except sqlite3.IntegrityError:
+                # Collided with another subscriber's code; the unique index rejected it.
+                continue
             if cursor.rowcount > 0:
                 logger.info("Referral code generated", extra={"email": email, "code": code})
                 return code
+            row = conn.execute("SELECT referral_code FROM subscribers WHERE email = ?;", (email,)).fetchone()
+            return row[0] if row else None
     return None
 
 
+@_retry_on_busy
 def mark_subscriber_as_lifetime(email: str) -> bool:
     """Mark a subscriber as having purchased lifetime access."""
     query = """
@@ -660,7 +1040,7 @@ def mark_subscriber_as_lifetime(email: str) -> bool:
     SET is_lifetime = 1, lifetime_purchased_at = CURRENT_TIMESTAMP, tier = 'ELITE'
     WHERE email = ?;
     """
-    with get_connection() as conn:
+    with write_connection() as conn:
         cursor = conn.execute(query, (email,))
         success = cursor.rowcount > 0
     if success:
@@ -671,7 +1051,7 @@ def mark_subscriber_as_lifetime(email: str) -> bool:
 def get_subscriber_by_referral_code(code: str) -> Optional[Subscriber]:
     """Fetch a subscriber by their referral code."""
     query = """
-    SELECT id, phone, email, whatsapp, channel_preferences, tier, created_at,
+    SELECT id, tier, channel_preferences, phone, email, whatsapp, created_at,
            trial_ends_at, subscription_credits, referral_code, referred_by
     FROM subscribers
     WHERE referral_code = ?;
@@ -681,56 +1061,62 @@ def get_subscriber_by_referral_code(code: str) -> Optional[Subscriber]:
     if not row:
         return None
     
-    channels = [channel.strip() for channel in (row["channel_preferences"] or "").split(",") if channel.strip()]
+    (
+        id_, tier, channel_preferences, phone, email, whatsapp, created_at,
+        trial_ends_at, subscription_credits, referral_code, referred_by,
+    ) = row
+    channels = [channel.strip() for channel in (channel_preferences or "").split(",") if channel.strip()]
     if not channels:
         channels = ["email"]
     
     return Subscriber(
-        id=row["id"],
-        tier=row["tier"] or "FREE",
-        channel_preferences=channels,
-        phone=row["phone"],
-        email=row["email"],
-        whatsapp=row["whatsapp"],
-        created_at=row["created_at"],
-        trial_ends_at=row["trial_ends_at"],
-        subscription_credits=row["subscription_credits"] or 0,
-        referral_code=row["referral_code"],
-        referred_by=row["referred_by"],
+        id_,
+        tier or "FREE",
+        channels,
+        phone,
+        email,
+        whatsapp,
+        created_at,
+        trial_ends_at,
+        subscription_credits or 0,
+        referral_code,
+        referred_by,
     )
 
 
+@_retry_on_busy
 def record_referral(referrer_code: str, referee_email: str, referee_phone: Optional[str] = None) -> bool:
     """Record a referral when someone signs up using a referral code."""
     query = """
     INSERT INTO referrals (referrer_code, referee_email, referee_phone)
-    VALUES (?, ?, ?);
+    VALUES (?, ?, ?)
+    ON CONFLICT(referrer_code, referee_email) DO NOTHING
     """
-    with get_connection() as conn:
+    with write_connection() as conn:
         try:
-            conn.execute(query, (referrer_code, referee_email, referee_phone))
-            logger.info("Referral recorded", extra={"referrer_code": referrer_code, "referee": referee_email})
-            return True
+            recorded = _execute_write(conn, query, (referrer_code, referee_email, referee_phone), "id")
         except sqlite3.IntegrityError:
-            logger.warning("Duplicate referral attempt", extra={"referrer_code": referrer_code, "referee": referee_email})
+            # Duplicates are absorbed by ON CONFLICT; this is an unknown referrer code.
+            logger.warning("Referral for unknown code", extra={"referrer_code": referrer_code, "referee": referee_email})
             return False
+    if recorded:
+        logger.info("Referral recorded", extra={"referrer_code": referrer_code, "referee": referee_email})
+    else:
+        logger.warning("Duplicate referral attempt", extra={"referrer_code": referrer_code, "referee": referee_email})
+    return recorded
 
 
+@_retry_on_busy
 def grant_referral_reward(referral_id: int) -> bool:
     """
     Grant 1 month Elite tier to BOTH the referrer and referee for a successful referral.
     Also increments successful_referrals counter and potentially unlocks WhatsApp.
     """
-    # First, mark the referral as rewarded
+    # Mark the referral as rewarded and read who was involved in one statement
     update_referral = """
     UPDATE referrals
     SET reward_granted = 1, rewarded_at = CURRENT_TIMESTAMP
-    WHERE id = ? AND reward_granted = 0;
-    """
-    
-    # Get the referrer code and referee email
-    get_referral_info = """
-    SELECT referrer_code, referee_email FROM referrals WHERE id = ?;
+    WHERE id = ? AND reward_granted = 0
     """
     
     # Add 1 Elite credit (1 month Elite tier) to the referrer
@@ -747,17 +1133,21 @@ def grant_referral_reward(referral_id: int) -> bool:
     WHERE email = ?;
     """
     
-    with get_connection() as conn:
-        cursor = conn.execute(update_referral, (referral_id,))
-        if cursor.rowcount == 0:
-            return False
-        
-        row = conn.execute(get_referral_info, (referral_id,)).fetchone()
+    with write_connection() as conn, _txn(conn):
+        if _SUPPORTS_RETURNING:
+            row = conn.execute(
+                f"{update_referral} RETURNING referrer_code, referee_email;", (referral_id,)
+            ).fetchone()
+        elif conn.execute(f"{update_referral};", (referral_id,)).rowcount > 0:
+            row = conn.execute(
+                "SELECT referrer_code, referee_email FROM referrals WHERE id = ?;", (referral_id,)
+            ).fetchone()
+        else:
+            row = None
         if not row:
             return False
         
-        referrer_code = row["referrer_code"]
-        referee_email = row["referee_email"]
+        referrer_code, referee_email = row
         
         # Grant Elite credit to referrer
         conn.execute(add_credit_referrer, (referrer_code,))
@@ -765,15 +1155,16 @@ def grant_referral_reward(referral_id: int) -> bool:
         # Grant Elite credit to referee
         conn.execute(add_credit_referee, (referee_email,))
         
-        # Increment successful referrals (this also unlocks WhatsApp at 3)
+        # Increment successful referrals (this also unlocks WhatsApp at 3);
+        # the writer lock is re-entrant, so this joins the open transaction.
         increment_successful_referrals(referrer_code)
-        
-        logger.info("Referral reward granted to BOTH parties", extra={
-            "referral_id": referral_id,
-            "referrer_code": referrer_code,
-            "referee_email": referee_email
-        })
-        return True
+    
+    logger.info("Referral reward granted to BOTH parties", extra={
+        "referral_id": referral_id,
+        "referrer_code": referrer_code,
+        "referee_email": referee_email
+    })
+    return True
 
 
 def get_pending_referrals(referrer_code: str) -> List[Referral]:
@@ -787,16 +1178,8 @@ def get_pending_referrals(referrer_code: str) -> List[Referral]:
         rows = conn.execute(query, (referrer_code,)).fetchall()
     
     return [
-        Referral(
-            id=row["id"],
-            referrer_code=row["referrer_code"],
-            referee_email=row["referee_email"],
-            referee_phone=row["referee_phone"],
-            reward_granted=bool(row["reward_granted"]),
-            created_at=row["created_at"],
-            rewarded_at=row["rewarded_at"],
-        )
-        for row in rows
+        Referral(id_, referrer_code, referee_email, referee_phone, bool(reward_granted), created_at, rewarded_at)
+        for id_, referrer_code, referee_email, referee_phone, reward_granted, created_at, rewarded_at in rows
     ]
 
 
@@ -812,66 +1195,68 @@ def get_all_referrals(referrer_code: str) -> List[Referral]:
         rows = conn.execute(query, (referrer_code,)).fetchall()
     
     return [
-        Referral(
-            id=row["id"],
-            referrer_code=row["referrer_code"],
-            referee_email=row["referee_email"],
-            referee_phone=row["referee_phone"],
-            reward_granted=bool(row["reward_granted"]),
-            created_at=row["created_at"],
-            rewarded_at=row["rewarded_at"],
-        )
-        for row in rows
+        Referral(id_, referrer_code, referee_email, referee_phone, bool(reward_granted), created_at, rewarded_at)
+        for id_, referrer_code, referee_email, referee_phone, reward_granted, created_at, rewarded_at in rows
     ]
 
 
+@_retry_on_busy
 def use_subscription_credit(email: str) -> bool:
     """Use one subscription credit (1 month free) for a subscriber."""
     query = """
     UPDATE subscribers
     SET subscription_credits = subscription_credits - 1
-    WHERE email = ? AND subscription_credits > 0;
+    WHERE email = ? AND subscription_credits > 0
     """
-    with get_connection() as conn:
-        cursor = conn.execute(query, (email,))
-        if cursor.rowcount > 0:
-            logger.info("Subscription credit used", extra={"email": email})
-            return True
-    return False
+    with write_connection() as conn:
+        used = _execute_write(conn, query, (email,), "subscription_credits")
+    if used:
+        logger.info("Subscription credit used", extra={"email": email})
+    return used
 
 
 def get_free_users_for_digest() -> List[Subscriber]:
     """Get all free tier users who should receive weekly digest (7+ days since last digest)."""
     query = """
-    SELECT * FROM subscribers
+    SELECT id, tier, channel_preferences, phone, email, whatsapp, created_at, trial_ends_at,
+           subscription_credits, referral_code, referred_by, successful_referrals,
+           whatsapp_unlocked, last_digest_sent
+    FROM subscribers INDEXED BY idx_subscribers_digest
     WHERE tier = 'FREE'
     AND email IS NOT NULL
-    AND (last_digest_sent IS NULL OR last_digest_sent < datetime('now', '-7 days'));
+    AND (last_digest_sent IS NULL OR last_digest_sent < ?);
     """
+    # Same UTC text format as CURRENT_TIMESTAMP, so the bound compares lexicographically.
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S")
     with get_connection() as conn:
-        rows = conn.execute(query).fetchall()
+        rows = conn.execute(query, (cutoff,)).fetchall()
     
     return [
         Subscriber(
-            id=row["id"],
-            tier=row["tier"],
-            channel_preferences=row["channel_preferences"].split(",") if row["channel_preferences"] else ["sms"],
-            phone=row["phone"],
-            email=row["email"],
-            whatsapp=row["whatsapp"],
-            created_at=row["created_at"],
-            trial_ends_at=row["trial_ends_at"],
-            subscription_credits=row.get("subscription_credits", 0),
-            referral_code=row.get("referral_code"),
-            referred_by=row.get("referred_by"),
-            successful_referrals=row.get("successful_referrals", 0),
-            whatsapp_unlocked=bool(row.get("whatsapp_unlocked", 0)),
-            last_digest_sent=row.get("last_digest_sent"),
+            id_,
+            tier,
+            channel_preferences.split(",") if channel_preferences else ["sms"],
+            phone,
+            email,
+            whatsapp,
+            created_at,
+            trial_ends_at,
+            subscription_credits or 0,
+            referral_code,
+            referred_by,
+            successful_referrals or 0,
+            bool(whatsapp_unlocked),
+            last_digest_sent,
         )
-        for row in rows
+        for (
+            id_, tier, channel_preferences, phone, email, whatsapp, created_at, trial_ends_at,
+            subscription_credits, referral_code, referred_by, successful_referrals,
+            whatsapp_unlocked, last_digest_sent,
+        ) in rows
     ]
 
 
+@_retry_on_busy
 def update_digest_sent(subscriber_id: int) -> None:
     """Mark that a digest email was sent to this subscriber."""
     query = """
@@ -879,66 +1264,61 @@ def update_digest_sent(subscriber_id: int) -> None:
     SET last_digest_sent = CURRENT_TIMESTAMP
     WHERE id = ?;
     """
-    with get_connection() as conn:
+    with write_connection() as conn:
         conn.execute(query, (subscriber_id,))
         logger.info("Digest timestamp updated", extra={"subscriber_id": subscriber_id})
 
 
+@_retry_on_busy
 def increment_successful_referrals(referral_code: str) -> int:
     """Increment successful referrals count and return new count. Unlocks WhatsApp at 3."""
-    update_count = """
+    # CASE sees the pre-update count, so the unlock lands in the same statement.
+    query = """
     UPDATE subscribers
-    SET successful_referrals = successful_referrals + 1
-    WHERE referral_code = ?;
+    SET successful_referrals = successful_referrals + 1,
+        whatsapp_unlocked = CASE WHEN successful_referrals + 1 >= 3 THEN 1 ELSE whatsapp_unlocked END
+    WHERE referral_code = ?
     """
     
-    get_count = """
-    SELECT successful_referrals FROM subscribers WHERE referral_code = ?;
-    """
+    with write_connection() as conn:
+        if _SUPPORTS_RETURNING:
+            row = conn.execute(f"{query} RETURNING successful_referrals;", (referral_code,)).fetchone()
+        else:
+            conn.execute(f"{query};", (referral_code,))
+            row = conn.execute(
+                "SELECT successful_referrals FROM subscribers WHERE referral_code = ?;", (referral_code,)
+            ).fetchone()
+    count = row[0] if row else 0
     
-    unlock_whatsapp = """
-    UPDATE subscribers
-    SET whatsapp_unlocked = 1
-    WHERE referral_code = ? AND successful_referrals >= 3;
-    """
+    if count >= 3:
+        logger.info("WhatsApp unlocked", extra={"referral_code": referral_code, "count": count})
     
-    with get_connection() as conn:
-        conn.execute(update_count, (referral_code,))
-        row = conn.execute(get_count, (referral_code,)).fetchone()
-        count = row["successful_referrals"] if row else 0
-        
-        if count >= 3:
-            conn.execute(unlock_whatsapp, (referral_code,))
-            logger.info("WhatsApp unlocked", extra={"referral_code": referral_code, "count": count})
-        
-        return count
+    return count
 
 
-def get_listings_from_past_week(keywords: str, max_price: int | None = None, min_bedrooms: int | None = None, limit: int = 10) -> List[Listing]:
+def get_listings_from_past_week(keywords: str, max_price: int | None = None, limit: int = 10) -> List[Listing]:
     """Get recent listings from the past 7 days matching criteria."""
-    conditions = ["first_seen > datetime('now', '-7 days')"]
-    params: List[Any] = []
+    # Bound like the digest cutoff so the planner can range-seek idx_listings_created.
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S")
+    conditions = ["created_at > ?"]
+    params: List[Any] = [cutoff]
     
-    # Split keywords and create LIKE conditions
-    if keywords:
-        keyword_list = [k.strip().lower() for k in keywords.split(",")]
-        keyword_conditions = " OR ".join(["LOWER(title) LIKE ?" for _ in keyword_list])
+    # Split keywords and create LIKE conditions (LIKE is case-insensitive for ASCII)
+    keyword_list = [k.strip() for k in keywords.split(",") if k.strip()] if keywords else []
+    if keyword_list:
+        keyword_conditions = " OR ".join(["title LIKE ?" for _ in keyword_list])
         conditions.append(f"({keyword_conditions})")
         params.extend([f"%{k}%" for k in keyword_list])
     
     if max_price is not None:
-        conditions.append("price <= ?")
-        params.append(max_price)
-    
-    if min_bedrooms is not None:
-        conditions.append("bedrooms >= ?")
-        params.append(min_bedrooms)
+        conditions.append("price_cents <= ?")
+        params.append(max_price * 100)
     
     where_clause = " AND ".join(conditions)
     query = f"""
-    SELECT * FROM listings
+    SELECT {_LISTING_COLUMNS} FROM listings
     WHERE {where_clause}
-    ORDER BY first_seen DESC
+    ORDER BY created_at DESC
     LIMIT ?;
     """
     params.append(limit)
@@ -946,20 +1326,6 @@ def get_listings_from_past_week(keywords: str, max_price: int | None = None, min
     with get_connection() as conn:
         rows = conn.execute(query, params).fetchall()
     
-    return [
-        Listing(
-            id=row["id"],
-            title=row["title"],
-            url=row["url"],
-            price=row["price"],
-            bedrooms=row.get("bedrooms"),
-            location=row.get("location"),
-            first_seen=row["first_seen"],
-        )
-        for row in rows
-    ]
-
+    return [Listing(*row) for row in rows]
 
-# Ensure the database schema exists on import.
-init_db()
 
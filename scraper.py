@@ -1,22 +1,37 @@
 from __future__ import annotations
 
 import argparse
+import functools
 import logging
 import random
+import re
 import sys
 import time
-from typing import List, Optional
-from urllib.parse import urljoin
+from typing import Iterator, List, Optional, Union
+from urllib.parse import urljoin, urlsplit
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
 
 from alerts import AlertService
 from config import get_settings
-from db import Listing, insert_listing, list_unnotified_listings
+from db import Listing, bulk_insert_listings, init_db, list_unnotified_listings
 
 logger = logging.getLogger(__name__)
 
+# Only marketplace item links (and their children) are built into the tree;
+# the rest of the page is skipped while parsing. Matching anchors only (not
+# wrapper divs) means a listing's link is not also visited via its container.
+_LISTING_STRAINER = SoupStrainer("a", href=re.compile(r"/marketplace/item/"))
+_MARKETPLACE_ITEM_RE = re.compile(r"/marketplace/item/([^/?]*)")
+_PRICE_RE = re.compile(r"\$[\d,]+(?:\.\d{2})?")
+# Minimum randomized gap (seconds) between scrape cycles, applied by the loop
+# after parsing and alerts rather than between fetching and parsing.
+_POLITENESS_DELAY = (1, 3)
+# Uncapped retry waits (seconds) for fetch_html: 5s doubling over five attempts.
+_BACKOFF_SCHEDULE = tuple(5 * (1 << i) for i in range(5))
+
 
 def configure_logging() -> None:
     logging.basicConfig(
@@ -25,11 +40,13 @@ def configure_logging() -> None:
     )
 
 
-def parse_listings(html: str, base_url: str) -> List[Listing]:
-    """Parse Facebook Marketplace HTML into Listing objects."""
-    soup = BeautifulSoup(html, "lxml")
-    listings: List[Listing] = []
+def iter_listings(html: Union[str, bytes], base_url: str) -> Iterator[Listing]:
+    """Yield Listing objects from Facebook Marketplace HTML as they are parsed."""
+    soup = BeautifulSoup(html, "lxml", parse_only=_LISTING_STRAINER)
     seen: set[str] = set()
+    # Marketplace links are root-relative, so most hrefs only need the base origin.
+    base_parts = urlsplit(base_url)
+    origin = f"{base_parts.scheme}://{base_parts.netloc}"
 
     # Facebook Marketplace uses dynamic rendering, so parsing raw HTML is limited
     # This is a basic implementation that looks for common patterns
@@ -37,37 +54,30 @@ def parse_listings(html: str, base_url: str) -> List[Listing]:
     
     # Look for marketplace listing containers (these selectors may need adjustment)
     # Facebook's class names are often minified/obfuscated
-    for item in soup.find_all(["div", "a"], attrs={"href": lambda x: x and "/marketplace/item/" in str(x)}):
+    for item in soup.find_all("a", href=True):
         # Extract listing ID from URL
         href = item.get("href", "")
-        if "/marketplace/item/" not in href:
-            continue
-            
         # Extract post ID from marketplace URL
-        post_id_match = href.split("/marketplace/item/")[-1].split("/")[0].split("?")[0]
-        if not post_id_match or post_id_match in seen:
+        post_id_match = _MARKETPLACE_ITEM_RE.search(href)
+        if not post_id_match:
+            continue
+        post_id = post_id_match.group(1)
+        if not post_id or post_id in seen:
             continue
-        post_id = post_id_match
         seen.add(post_id)
 
-        # Try to extract title - look for text in the link or nearby elements
-        title = item.get_text(strip=True) if item.get_text(strip=True) else None
-        if not title:
-            # Try to find title in child elements
-            title_candidates = item.find_all(["span", "div"], recursive=True)
-            for candidate in title_candidates:
-                text = candidate.get_text(strip=True)
-                if text and len(text) > 5 and len(text) < 200:
-                    title = text
-                    break
+        # Walk the link's text once; the two joins match get_text() and
+        # get_text(strip=True). If the stripped text is empty every child's is
+        # too, so there is no point searching child elements for a title.
+        strings = list(item.strings)
+        title = "".join(text.strip() for text in strings) or None
         
         # Look for price - Facebook typically shows prices with $ symbol
         price = None
-        price_text = item.get_text()
+        price_text = "".join(strings)
         if "$" in price_text:
             # Extract price pattern
-            import re
-            price_match = re.search(r'\$[\d,]+(?:\.\d{2})?', price_text)
+            price_match = _PRICE_RE.search(price_text)
             if price_match:
                 price = price_match.group()
 
@@ -76,7 +86,12 @@ def parse_listings(html: str, base_url: str) -> List[Listing]:
         neighborhood = None
 
         # Build full URL
-        url = urljoin(base_url, href) if not href.startswith("http") else href
+        if href.startswith("http"):
+            url = href
+        elif href.startswith("/") and not href.startswith("//"):
+            url = origin + href
+        else:
+            url = urljoin(base_url, href)
         # Clean up URL parameters
         url = url.split("?")[0]
 
@@ -84,39 +99,51 @@ def parse_listings(html: str, base_url: str) -> List[Listing]:
             logger.warning("Listing missing title", extra={"post_id": post_id})
             title = "Facebook Marketplace Listing"
 
-        listings.append(
-            Listing(
-                post_id=post_id,
-                title=title,
-                price=price,
-                neighborhood=neighborhood,
-                url=url,
-            )
+        yield Listing(
+            post_id=post_id,
+            title=title,
+            price=price,
+            neighborhood=neighborhood,
+            url=url,
         )
 
     # If no listings found with the above method, log a warning
-    if not listings:
+    if not seen:
         logger.warning(
             "No Facebook Marketplace listings parsed. "
             "Facebook uses dynamic rendering - consider using Selenium or the Graph API for better results."
         )
 
-    return listings
 
+def parse_listings(html: Union[str, bytes], base_url: str) -> List[Listing]:
+    """Parse Facebook Marketplace HTML into Listing objects."""
+    return list(iter_listings(html, base_url))
 
-def fetch_html(session: requests.Session, url: str, timeout: int, max_backoff: int) -> Optional[str]:
-    """Fetch HTML content with exponential backoff and jitter."""
-    max_attempts = 5
-    base_delay = 5
 
-    for attempt in range(1, max_attempts + 1):
+@functools.lru_cache(maxsize=1)
+def _get_session() -> requests.Session:
+    """Return the shared HTTP session so keep-alive connections survive between scrapes."""
+    session = requests.Session()
+    session.headers.update({"User-Agent": get_settings().user_agent})
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def fetch_html(session: requests.Session, url: str, timeout: int, max_backoff: int) -> Optional[bytes]:
+    """Fetch raw HTML bytes with exponential backoff and jitter."""
+    max_attempts = len(_BACKOFF_SCHEDULE)
+
+    for attempt, base_wait in enumerate(_BACKOFF_SCHEDULE, start=1):
         try:
             response = session.get(url, timeout=timeout)
             response.raise_for_status()
-            time.sleep(random.uniform(1, 3))
-            return response.text
+            # Raw bytes let lxml decode once using the page's own charset, skipping
+            # requests' charset sniffing and an intermediate str copy.
+            return response.content
         except requests.RequestException as exc:
-            wait_seconds = min(max_backoff, base_delay * (2 ** (attempt - 1)))
+            wait_seconds = min(max_backoff, base_wait)
             logger.warning(
                 "Request failed; backing off",
                 extra={
@@ -138,11 +165,8 @@ def run_once(alert_service: AlertService) -> None:
         logger.error("TARGET_URL must be configured before running the scraper.")
         return
 
-    session = requests.Session()
-    session.headers.update({"User-Agent": settings.user_agent})
-
     html = fetch_html(
-        session=session,
+        session=_get_session(),
         url=settings.target_url,
         timeout=settings.request_timeout_seconds,
         max_backoff=settings.max_backoff_seconds,
@@ -150,19 +174,13 @@ def run_once(alert_service: AlertService) -> None:
     if not html:
         return
 
-    parsed_listings = parse_listings(html, settings.target_url)
-    if not parsed_listings:
-        logger.info("No listings found on page.")
-        return
-
-    new_listings: List[Listing] = []
-    for listing in parsed_listings:
-        if insert_listing(listing):
-            new_listings.append(listing)
+    # Listings stream from the parser straight into the insert batch; an empty
+    # page is reported by iter_listings itself.
+    new_listings = bulk_insert_listings(iter_listings(html, settings.target_url))
 
     logger.info(
         "Scrape cycle complete",
-        extra={"fetched": len(parsed_listings), "inserted": len(new_listings)},
+        extra={"inserted": len(new_listings)},
     )
 
     pending_notifications = list_unnotified_listings(limit=None)
@@ -191,6 +209,7 @@ def main(argv: Optional[List[str]] = None) -> None:
     args = parser.parse_args(argv)
 
     settings = get_settings()
+    init_db()
     alert_service = AlertService(settings=settings)
 
     if args.once or args.command == "once":
@@ -203,7 +222,7 @@ def main(argv: Optional[List[str]] = None) -> None:
             start = time.time()
             run_once(alert_service)
             elapsed = time.time() - start
-            sleep_for = max(0, settings.scrape_interval_seconds - elapsed)
+            sleep_for = max(random.uniform(*_POLITENESS_DELAY), settings.scrape_interval_seconds - elapsed)
             if sleep_for:
                 logger.info("Sleeping before next scrape", extra={"seconds": round(sleep_for, 2)})
                 time.sleep(sleep_for)
@@ -1,4 +1,4 @@
-import importlib
+import shutil
 import sys
 from collections.abc import Iterator
 from pathlib import Path
@@ -10,23 +10,37 @@ ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+import alerts  # noqa: E402
 import config  # noqa: E402
-
-
-def _reload_module(name: str):
-    if name in sys.modules:
-        return importlib.reload(sys.modules[name])
-    return importlib.import_module(name)
+import db  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def schema_db(tmp_path_factory) -> Path:
+    """Build the schema once per session (per xdist worker) for tests to copy."""
+    path = tmp_path_factory.mktemp("schema") / "schema.db"
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("DATABASE_PATH", str(path))
+        config.get_settings.cache_clear()
+        db.reset_connections()
+        db.init_db()
+        db.close_connections()
+    config.get_settings.cache_clear()
+    return path
 
 
 @pytest.fixture
-def app_env(tmp_path, monkeypatch) -> Iterator[None]:
+def app_env(tmp_path, monkeypatch, schema_db) -> Iterator[None]:
     """Reset environment for each test with an isolated database."""
-    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "test.db"))
+    database_path = tmp_path / "test.db"
+    shutil.copyfile(schema_db, database_path)
+    monkeypatch.setenv("DATABASE_PATH", str(database_path))
     monkeypatch.setenv("TARGET_URL", "https://example.com/target")
     config.get_settings.cache_clear()
 
-    _reload_module("db")
-    _reload_module("alerts")
+    db.reset_connections()
+    # A no-op on the copied schema unless the snapshot is out of date.
+    db.init_db()
+    alerts.reset()
     yield
 
@@ -1,5 +1,7 @@
 import importlib
 
+import pytest
+
 import config
 
 
@@ -53,3 +55,76 @@ def test_alerts_send_once_per_listing(app_env, monkeypatch):
     sent_after = service.send_alerts(pending_after)
     assert sent_after == 0
     assert len(fake_client.messages.outbound) == 1
+
+
+class FakeSMTP:
+    def __init__(self):
+        self.quit_called = False
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_smtp_pool_reuses_and_closes_sessions():
+    alerts_module = importlib.import_module("alerts")
+    opened = []
+
+    def connect():
+        opened.append(FakeSMTP())
+        return opened[-1]
+
+    pool = alerts_module.SMTPPool(connect, size=2)
+
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+    pool.release(first)
+    assert pool.acquire() is first
+    assert len(opened) == 2
+
+    pool.release(first)
+    pool.release(second)
+    pool.close()
+    assert all(smtp.quit_called for smtp in opened)
+
+
+def test_smtp_pool_frees_the_slot_when_connect_fails():
+    alerts_module = importlib.import_module("alerts")
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("connection refused")
+        return FakeSMTP()
+
+    pool = alerts_module.SMTPPool(connect, size=1)
+    with pytest.raises(OSError):
+        pool.acquire()
+    assert isinstance(pool.acquire(), FakeSMTP)
+
+
+def test_overlapping_email_batches_share_one_pool(app_env, monkeypatch):
+    alerts_module = importlib.import_module("alerts")
+    service = alerts_module.EmailService(config.get_settings())
+    opened = []
+
+    def connect():
+        smtp = FakeSMTP()
+        smtp.send_message = lambda msg: None
+        opened.append(smtp)
+        return smtp
+
+    monkeypatch.setattr(service, "_connect", connect)
+    msg = service._create_message("Subject", "Body")
+
+    with service:
+        with service:
+            service._send(msg)
+        # The inner block exiting must not close the outer block's sessions.
+        assert service._pool is not None
+        assert not any(smtp.quit_called for smtp in opened)
+        service._send(msg)
+
+    assert service._pool is None
+    assert opened and all(smtp.quit_called for smtp in opened)
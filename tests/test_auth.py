@@ -0,0 +1,27 @@
+import hashlib
+
+import auth
+
+
+def test_scrypt_hash_round_trips():
+    encoded = auth.hash_password("supersecret")
+
+    assert encoded.startswith(f"{auth.HASH_VERSION}${auth.SCRYPT_NAME}$")
+    assert auth.verify_password("supersecret", encoded)
+    assert not auth.verify_password("wrongsecret", encoded)
+    assert auth.hash_password("supersecret") != encoded
+
+
+def test_legacy_pbkdf2_hash_still_verifies():
+    salt = bytes(range(auth.SALT_SIZE))
+    key = hashlib.pbkdf2_hmac(auth.HASH_NAME, b"supersecret", salt, 1_000)
+    encoded = f"{auth.HASH_NAME}$1000${salt.hex()}${key.hex()}"
+
+    assert auth.verify_password("supersecret", encoded)
+    assert not auth.verify_password("wrongsecret", encoded)
+
+
+def test_malformed_hash_is_rejected():
+    assert not auth.verify_password("supersecret", "")
+    assert not auth.verify_password("supersecret", "v2$scrypt$not-base64")
+    assert not auth.verify_password("supersecret", "md5$1$00$00")
@@ -38,3 +38,40 @@ def test_register_login_dashboard_flow(app_env):
     assert login.status_code == 303
     assert login.headers["location"] == "/dashboard"
 
+
+
+def test_session_cookie_scan_matches_whole_cookie_names(app_env):
+    web = importlib.reload(importlib.import_module("web"))
+
+    assert web._session_token([(b"cookie", b"session_token=abc")]) == "abc"
+    assert web._session_token([(b"cookie", b"theme=dark; session_token=abc; lang=en")]) == "abc"
+    assert web._session_token([(b"cookie", b"xsession_token=bad")]) is None
+    assert web._session_token([(b"cookie", b"xsession_token=bad; session_token=good")]) == "good"
+    assert web._session_token([(b"cookie", b"theme=dark"), (b"cookie", b"session_token=abc")]) == "abc"
+    assert web._session_token([(b"cookie", b"session_token=")]) is None
+    assert web._session_token([(b"host", b"session_token=abc")]) is None
+
+
+def test_logout_invalidates_cached_session(app_env):
+    config.get_settings.cache_clear()
+    web = importlib.reload(importlib.import_module("web"))
+    client = TestClient(web.app)
+
+    client.post(
+        "/register",
+        data={"email": "cached@example.com", "password": "supersecret"},
+        follow_redirects=False,
+    )
+    token = client.cookies.get(web.SESSION_COOKIE_NAME)
+    assert token
+    # Two authenticated requests, so the second is served from the session cache.
+    assert client.get("/dashboard", follow_redirects=False).status_code == 200
+    assert client.get("/settings", follow_redirects=False).status_code == 200
+
+    client.post("/logout", follow_redirects=False)
+
+    # Replaying the old cookie must not reach the cached user.
+    replay = TestClient(web.app, cookies={web.SESSION_COOKIE_NAME: token})
+    dashboard = replay.get("/dashboard", follow_redirects=False)
+    assert dashboard.status_code == 303
+    assert dashboard.headers["location"] == "/login"
@@ -0,0 +1,162 @@
+import sqlite3
+import threading
+
+import config
+import db
+
+
+def _use_database(monkeypatch, path) -> None:
+    monkeypatch.setenv("DATABASE_PATH", str(path))
+    config.get_settings.cache_clear()
+    db.reset_connections()
+
+
+def test_init_db_migrates_pre_referral_schema(tmp_path, monkeypatch):
+    path = tmp_path / "legacy.db"
+    legacy = sqlite3.connect(path)
+    legacy.executescript(
+        """
+        CREATE TABLE listings (
+            post_id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            price TEXT,
+            neighborhood TEXT,
+            url TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            notified_at TIMESTAMP
+        );
+        CREATE TABLE subscribers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone TEXT UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO subscribers (phone) VALUES ('+15555550100');
+        INSERT INTO listings (post_id, title, price, url) VALUES ('old1', 'Old flat', '$1,250', 'https://example.com/old1');
+        """
+    )
+    legacy.close()
+
+    _use_database(monkeypatch, path)
+    db.init_db()
+
+    assert db.get_subscriber_count() == 1
+    assert db.get_listing_count() == 1
+
+    db.upsert_subscriber(tier="FREE", channels=["email"], email="referrer@example.com")
+    code = db.set_referral_code("referrer@example.com")
+    assert code
+    assert db.record_referral(code, "friend@example.com") is True
+    assert db.record_referral(code, "friend@example.com") is False
+    assert [ref.referee_email for ref in db.get_pending_referrals(code)] == ["friend@example.com"]
+
+
+def test_record_referral_rejects_unknown_code_on_current_schema(app_env):
+    # app_env's init_db is a no-op here, so foreign keys must not depend on it.
+    assert db.record_referral("NOPE", "friend@example.com") is False
+    assert db.get_pending_referrals("NOPE") == []
+
+
+def test_bulk_insert_listings_retries_a_generator_while_locked(app_env):
+    blocker = sqlite3.connect(db.DB_PATH, isolation_level=None, check_same_thread=False)
+    blocker.execute("BEGIN IMMEDIATE")
+    release = threading.Timer(0.2, blocker.execute, args=("ROLLBACK",))
+    release.start()
+    try:
+        new = db.bulk_insert_listings(
+            db.Listing(post_id=f"gen{i}", title="Flat", url=f"https://example.com/gen{i}")
+            for i in range(3)
+        )
+    finally:
+        release.join()
+        blocker.close()
+
+    assert [listing.post_id for listing in new] == ["gen0", "gen1", "gen2"]
+    assert db.get_listing_count() == 3
+
+
+def _listing(post_id: str, title: str = "Flat") -> db.Listing:
+    return db.Listing(post_id=post_id, title=title, url=f"https://example.com/{post_id}", price="$1,000")
+
+
+def test_bulk_insert_listings_returns_only_new_rows(app_env):
+    assert db.insert_listing(_listing("a1"))
+
+    new = db.bulk_insert_listings([_listing("a1"), _listing("b2", "First"), _listing("b2", "Second"), _listing("c3")])
+
+    assert [(listing.post_id, listing.title) for listing in new] == [("b2", "First"), ("c3", "Flat")]
+    assert db.bulk_insert_listings([_listing("b2")]) == []
+    assert db.bulk_insert_listings([]) == []
+    assert db.get_listing_count() == 3
+
+
+def test_row_counters_track_inserts_and_deletes(app_env):
+    assert db.get_listing_count() == 0
+    assert db.get_subscriber_count() == 0
+
+    db.bulk_insert_listings([_listing("a1"), _listing("b2")])
+    db.upsert_subscriber(tier="FREE", channels=["email"], email="one@example.com")
+    db.upsert_subscriber(tier="FREE", channels=["email"], email="two@example.com")
+    # Updating an existing subscriber must not count it twice.
+    db.upsert_subscriber(tier="ELITE", channels=["email"], email="two@example.com")
+    assert db.get_listing_count() == 2
+    assert db.get_subscriber_count() == 2
+
+    with db.write_connection() as conn:
+        conn.execute("DELETE FROM listings WHERE post_id = 'a1';")
+        conn.execute("DELETE FROM subscribers WHERE email = 'one@example.com';")
+    assert db.get_listing_count() == 1
+    assert db.get_subscriber_count() == 1
+
+
+def test_record_referral_keeps_one_row_per_pair(app_env):
+    db.upsert_subscriber(tier="FREE", channels=["email"], email="referrer@example.com")
+    code = db.set_referral_code("referrer@example.com")
+
+    assert db.record_referral(code, "friend@example.com", "+15555550101") is True
+    assert db.record_referral(code, "friend@example.com") is False
+    assert db.record_referral(code, "other@example.com") is True
+    assert sorted(ref.referee_email for ref in db.get_all_referrals(code)) == [
+        "friend@example.com",
+        "other@example.com",
+    ]
+
+
+def test_set_referral_code_returns_existing_code(app_env):
+    db.upsert_subscriber(tier="FREE", channels=["email"], email="referrer@example.com")
+
+    code = db.set_referral_code("referrer@example.com")
+
+    assert code
+    assert db.set_referral_code("referrer@example.com") == code
+    assert db.get_subscriber_by_referral_code(code).email == "referrer@example.com"
+    assert db.set_referral_code("missing@example.com") is None
+
+
+def test_ttl_cache_is_invalidated_by_writes(app_env):
+    calls = []
+
+    @db._ttl_cache(60)
+    def lookup(key: str) -> int:
+        calls.append(key)
+        return len(calls)
+
+    assert lookup("a") == 1
+    assert lookup("a") == 1
+    assert lookup("b") == 2
+    with db.write_connection():
+        pass
+    assert lookup("a") == 3
+    assert calls == ["a", "b", "a"]
+
+
+def test_readers_of_finished_threads_are_closed(app_env):
+    def read() -> None:
+        db.get_listing_count.__wrapped__()
+
+    for _ in range(3):
+        worker = threading.Thread(target=read)
+        worker.start()
+        worker.join()
+    read()
+
+    assert list(db._readers) == [threading.current_thread()]
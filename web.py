@@ -3,18 +3,23 @@ from __future__ import annotations
 
 import logging
 import secrets
-from typing import Dict, Optional
-from urllib.parse import parse_qs
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
 
 import stripe
 from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import FormData
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from auth import create_session_token, hash_password, normalize_email, verify_password
 from config import get_settings
 from db import (
     User,
+    init_db,
     create_session,
     delete_session,
     get_recent_listings,
@@ -45,11 +50,34 @@ from db import (
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-templates = Jinja2Templates(directory="templates")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Prepare the database and compile every template before serving requests."""
+    init_db()
+    for name in templates.env.list_templates():
+        templates.env.get_template(name)
+    for name in _STATIC_TEMPLATES:
+        _static_page(name)
+    yield
+
+
+# Handlers that only call blocking code (SQLite, SMTP, template rendering) are
+# plain ``def`` so FastAPI runs them in its threadpool; handlers that must await
+# the request body hand the rest of their work to a sync helper there.
+app = FastAPI(lifespan=lifespan)
 
 settings = get_settings()
 
+# Compiled template bytecode persists across restarts in a per-user temp
+# directory; outside debug, templates are not re-stat'ed on every render.
+templates = Jinja2Templates(
+    directory="templates",
+    auto_reload=settings.debug,
+    bytecode_cache=FileSystemBytecodeCache(),
+    cache_size=400,
+)
+
 if settings.stripe_api_key:
     stripe.api_key = settings.stripe_api_key
 
@@ -126,6 +154,31 @@ PLAN_DETAILS = [
 ]
 
 
+_VALID_CHANNELS = frozenset({"sms", "email", "whatsapp"})
+_PHONE_CHANNELS = frozenset({"sms", "whatsapp"})
+_ALL_CHANNELS = ("sms", "email", "whatsapp")
+
+# Checkout parameters per purchasable plan, built once from settings.
+# A channels value of None means the buyer's chosen channel is used.
+PLAN_CONFIG: Dict[str, Dict[str, Any]] = {
+    "essential": {
+        "price_id": settings.stripe_price_id_essential,
+        "channels": None,
+        "mode": "subscription",
+    },
+    "elite": {
+        "price_id": settings.stripe_price_id_elite,
+        "channels": _ALL_CHANNELS,
+        "mode": "subscription",
+    },
+    "lifetime": {
+        "price_id": settings.stripe_price_id_lifetime,
+        "channels": _ALL_CHANNELS,
+        "mode": "payment",
+    },
+}
+
+
 def _set_session_cookie(response: Response, token: str) -> None:
     response.set_cookie(
         key=SESSION_COOKIE_NAME,
@@ -140,11 +193,78 @@ def _clear_session_cookie(response: Response) -> None:
     response.delete_cookie(SESSION_COOKIE_NAME)
 
 
+_SESSION_COOKIE_PREFIX = f"{SESSION_COOKIE_NAME}=".encode("ascii")
+
+
+def _session_token(headers: list[tuple[bytes, bytes]]) -> Optional[str]:
+    """Return the session cookie value from raw ASGI headers.
+
+    Scans the Cookie header bytes for our one key instead of parsing every
+    cookie into a dict.
+    """
+    prefix = _SESSION_COOKIE_PREFIX
+    for name, value in headers:
+        if name != b"cookie":
+            continue
+        start = value.find(prefix)
+        while start != -1:
+            # Only a match at a cookie boundary counts (not e.g. "xsession_token=").
+            if start == 0 or value[start - 1] in b"; ":
+                start += len(prefix)
+                end = value.find(b";", start)
+                token = value[start:] if end == -1 else value[start:end]
+                return token.strip().decode("latin-1") or None
+            start = value.find(prefix, start + 1)
+    return None
+
+
+class SessionUserMiddleware:
+    """Pure ASGI middleware that stashes the session token in request state.
+
+    The user itself is resolved lazily by ``_current_user`` and memoized in the
+    same state, so a request hits the sessions table at most once.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["session_token"] = _session_token(scope["headers"])
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(SessionUserMiddleware)
+
+
 def _current_user(request: Request) -> Optional[User]:
-    token = request.cookies.get(SESSION_COOKIE_NAME)
-    if not token:
-        return None
-    return get_user_by_session(token)
+    state = request.scope.setdefault("state", {})
+    if "user" not in state:
+        token = state.get("session_token")
+        state["user"] = get_user_by_session(token) if token else None
+    return state["user"]
+
+
+# Templates that render identically for every visitor (they use neither the
+# request nor the user), served from bytes rendered once per process.
+_STATIC_TEMPLATES = (
+    "privacy.html",
+    "terms.html",
+    "success.html",
+    "faq.html",
+    "promo.html",
+    "promo_resellers.html",
+    "register.html",
+    "login.html",
+)
+_STATIC_PAGES: Dict[str, bytes] = {}
+
+
+def _static_page(name: str) -> HTMLResponse:
+    body = _STATIC_PAGES.get(name)
+    if body is None or settings.debug:
+        body = _STATIC_PAGES[name] = templates.get_template(name).render().encode("utf-8")
+    return HTMLResponse(body)
 
 
 def _subscription_context(
@@ -165,7 +285,7 @@ def _subscription_context(
     }
 
 @app.get("/", name="landing", response_class=HTMLResponse)
-async def landing(request: Request) -> HTMLResponse:
+def landing(request: Request) -> HTMLResponse:
     """Render the marketing landing page."""
     # Check for success/cancel from Stripe
     if request.query_params.get("success") == "true":
@@ -194,7 +314,7 @@ async def health() -> Dict[str, str]:
 
 
 @app.get("/subscribe", response_class=HTMLResponse)
-async def subscribe_page(request: Request) -> HTMLResponse:
+def subscribe_page(request: Request) -> HTMLResponse:
     status_flag = request.query_params.get("status")
     message = None
     message_type = None
@@ -213,7 +333,11 @@ async def subscribe_page(request: Request) -> HTMLResponse:
 
 @app.post("/subscribe/free")
 async def subscribe_free(request: Request) -> Response:
-    form = await _parse_form_data(request)
+    form = await request.form()
+    return await run_in_threadpool(_subscribe_free, request, form)
+
+
+def _subscribe_free(request: Request, form: FormData) -> Response:
     email = normalize_email(form.get("email", ""))
     if not email or "@" not in email:
         context = _subscription_context(
@@ -249,30 +373,12 @@ async def create_checkout_session(request: Request) -> JSONResponse:
         logger.error("Stripe credentials missing; cannot create Checkout session.")
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Stripe unavailable.")
 
-    form = await _parse_form_data(request)
+    form = await request.form()
     plan = (form.get("plan") or "essential").lower()
     channel_choice = (form.get("channel") or "sms").lower()
     referral_code = form.get("referral_code", "").strip()
 
-    plan_config: Dict[str, Dict[str, object]] = {
-        "essential": {
-            "price_id": settings.stripe_price_id_essential,
-            "channels": [channel_choice if channel_choice in {"sms", "email", "whatsapp"} else "sms"],
-            "mode": "subscription",
-        },
-        "elite": {
-            "price_id": settings.stripe_price_id_elite,
-            "channels": ["sms", "email", "whatsapp"],
-            "mode": "subscription",
-        },
-        "lifetime": {
-            "price_id": settings.stripe_price_id_lifetime,
-            "channels": ["sms", "email", "whatsapp"],
-            "mode": "payment",
-        },
-    }
-
-    config = plan_config.get(plan)
+    config = PLAN_CONFIG.get(plan)
     if config is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported plan selected.")
 
@@ -281,12 +387,16 @@ async def create_checkout_session(request: Request) -> JSONResponse:
         logger.error("Stripe price ID missing for plan", extra={"plan": plan})
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Plan unavailable.")
 
-    channels = config["channels"]  # type: ignore[assignment]
+    # Essential lets the buyer pick one channel; other plans have a fixed set.
+    channels = config["channels"] or (channel_choice if channel_choice in _VALID_CHANNELS else "sms",)
     channels_str = ",".join(channels)
-    mode = config["mode"]  # type: ignore[assignment]
+    mode = config["mode"]
 
-    success_url = str(request.url_for("landing")) + "?success=true"
-    cancel_url = str(request.url_for("landing")) + "?canceled=true"
+    # The landing page is mounted at the app root, so base_url is its URL
+    # without a router lookup.
+    landing_url = request.base_url
+    success_url = f"{landing_url}?success=true"
+    cancel_url = f"{landing_url}?canceled=true"
 
     # Add 3-day free trial for Essential plan only (not for lifetime)
     trial_config = {}
@@ -294,12 +404,14 @@ async def create_checkout_session(request: Request) -> JSONResponse:
         trial_config = {"subscription_data": {"trial_period_days": 3}}
     
     try:
-        session = stripe.checkout.Session.create(
+        # The SDK call is a blocking HTTPS round trip to Stripe.
+        session = await run_in_threadpool(
+            stripe.checkout.Session.create,
             mode=mode,
             line_items=[{"price": price_id, "quantity": 1}],
             success_url=success_url,
             cancel_url=cancel_url,
-            phone_number_collection={"enabled": bool({"sms", "whatsapp"}.intersection(channels))},
+            phone_number_collection={"enabled": not _PHONE_CHANNELS.isdisjoint(channels)},
             customer_creation="always",
             metadata={
                 "tier": plan.upper(),
@@ -338,88 +450,91 @@ async def stripe_webhook(request: Request) -> JSONResponse:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid signature.")
 
     if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-        customer_details = session.get("customer_details") or {}
-        phone = customer_details.get("phone")
-        email = customer_details.get("email")
-        metadata = session.get("metadata") or {}
-        tier = (metadata.get("tier") or "ESSENTIAL").upper()
-        channels_raw = metadata.get("channels") or "sms"
-        channels = [c.strip() for c in channels_raw.split(",") if c.strip()]
-        referral_code = metadata.get("referral_code", "").strip()
-        is_lifetime = metadata.get("is_lifetime", "false").lower() == "true"
-        
-        whatsapp_contact = None
-        if "whatsapp" in channels and phone:
-            whatsapp_contact = phone if phone.startswith("whatsapp:") else f"whatsapp:{phone}"
-
-        if not phone and not email:
-            logger.warning("Checkout session missing contact info", extra={"session_id": session.get("id")})
-        else:
-            inserted = upsert_subscriber(
-                tier=tier,
-                channels=channels,
-                phone=phone if "sms" in channels or "whatsapp" in channels else None,
-                email=email if "email" in channels else None,
-                whatsapp=whatsapp_contact,
-            )
-            
-            # Mark as lifetime if applicable
-            if is_lifetime and email:
-                mark_subscriber_as_lifetime(email)
-                logger.info("Marked subscriber as lifetime", extra={"email": email})
-            
-            # Generate referral code for new subscriber
-            if email and inserted:
-                set_referral_code(email)
-            
-            # Process referral if code was provided
-            if referral_code and email:
-                referrer = get_subscriber_by_referral_code(referral_code)
-                if referrer:
-                    # Record the referral
-                    record_referral(referral_code, email, phone)
-                    # Find pending referrals for this referee
-                    pending = get_pending_referrals(referral_code)
-                    for ref in pending:
-                        if ref.referee_email == email:
-                            # Grant reward (1 month free) to referrer
-                            grant_referral_reward(ref.id)
-                            logger.info("Referral reward processed", extra={
-                                "referrer_code": referral_code,
-                                "referee": email
-                            })
-            
-            logger.info(
-                "Processed subscriber from Stripe",
-                extra={
-                    "phone": phone,
-                    "email": email,
-                    "channels": channels,
-                    "tier": tier,
-                    "is_lifetime": is_lifetime,
-                    "inserted": inserted,
-                    "session_id": session.get("id"),
-                },
-            )
+        await run_in_threadpool(_process_checkout_session, event["data"]["object"])
 
     return JSONResponse({"status": "ok"})
 
 
-@app.get("/register", response_class=HTMLResponse)
-async def register_form(request: Request) -> HTMLResponse:
-    return templates.TemplateResponse("register.html", {"request": request, "user": _current_user(request)})
+def _process_checkout_session(session: Dict[str, Any]) -> None:
+    """Create or update the subscriber for a completed Checkout session."""
+    customer_details = session.get("customer_details") or {}
+    phone = customer_details.get("phone")
+    email = customer_details.get("email")
+    metadata = session.get("metadata") or {}
+    tier = (metadata.get("tier") or "ESSENTIAL").upper()
+    channels_raw = metadata.get("channels") or "sms"
+    channels = [c.strip() for c in channels_raw.split(",") if c.strip()]
+    referral_code = metadata.get("referral_code", "").strip()
+    is_lifetime = metadata.get("is_lifetime", "false").lower() == "true"
+
+    whatsapp_contact = None
+    if "whatsapp" in channels and phone:
+        whatsapp_contact = phone if phone.startswith("whatsapp:") else f"whatsapp:{phone}"
+
+    if not phone and not email:
+        logger.warning("Checkout session missing contact info", extra={"session_id": session.get("id")})
+        return
+
+    inserted = upsert_subscriber(
+        tier=tier,
+        channels=channels,
+        phone=phone if "sms" in channels or "whatsapp" in channels else None,
+        email=email if "email" in channels else None,
+        whatsapp=whatsapp_contact,
+    )
+
+    # Mark as lifetime if applicable
+    if is_lifetime and email:
+        mark_subscriber_as_lifetime(email)
+        logger.info("Marked subscriber as lifetime", extra={"email": email})
+
+    # Generate referral code for new subscriber
+    if email and inserted:
+        set_referral_code(email)
+
+    # Process referral if code was provided
+    if referral_code and email:
+        referrer = get_subscriber_by_referral_code(referral_code)
+        if referrer:
+            # Record the referral
+            record_referral(referral_code, email, phone)
+            # Find pending referrals for this referee
+            pending = get_pending_referrals(referral_code)
+            for ref in pending:
+                if ref.referee_email == email:
+                    # Grant reward (1 month free) to referrer
+                    grant_referral_reward(ref.id)
+                    logger.info("Referral reward processed", extra={
+                        "referrer_code": referral_code,
+                        "referee": email
+                    })
+
+    logger.info(
+        "Processed subscriber from Stripe",
+        extra={
+            "phone": phone,
+            "email": email,
+            "channels": channels,
+            "tier": tier,
+            "is_lifetime": is_lifetime,
+            "inserted": inserted,
+            "session_id": session.get("id"),
+        },
+    )
 
 
-async def _parse_form_data(request: Request) -> Dict[str, str]:
-    body = await request.body()
-    data = parse_qs(body.decode("utf-8"))
-    return {key: values[0] for key, values in data.items() if values}
+@app.get("/register", response_class=HTMLResponse)
+async def register_form() -> HTMLResponse:
+    return _static_page("register.html")
 
 
 @app.post("/register")
 async def register_user(request: Request) -> Response:
-    form = await _parse_form_data(request)
+    form = await request.form()
+    return await run_in_threadpool(_register_user, request, form)
+
+
+def _register_user(request: Request, form: FormData) -> Response:
     normalized_email = normalize_email(form.get("email", ""))
     password = form.get("password", "").strip()
 
@@ -474,13 +589,17 @@ async def register_user(request: Request) -> Response:
 
 
 @app.get("/login", response_class=HTMLResponse)
-async def login_form(request: Request) -> HTMLResponse:
-    return templates.TemplateResponse("login.html", {"request": request, "user": _current_user(request)})
+async def login_form() -> HTMLResponse:
+    return _static_page("login.html")
 
 
 @app.post("/login")
 async def login_user(request: Request) -> Response:
-    form = await _parse_form_data(request)
+    form = await request.form()
+    return await run_in_threadpool(_login_user, request, form)
+
+
+def _login_user(request: Request, form: FormData) -> Response:
     normalized_email = normalize_email(form.get("email", ""))
     password = form.get("password", "").strip()
     user = get_user_by_email(normalized_email)
@@ -501,8 +620,8 @@ async def login_user(request: Request) -> Response:
 
 
 @app.post("/logout")
-async def logout_user(request: Request) -> Response:
-    token = request.cookies.get(SESSION_COOKIE_NAME)
+def logout_user(request: Request) -> Response:
+    token = request.scope.get("state", {}).get("session_token")
     if token:
         delete_session(token)
     response = RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
@@ -511,7 +630,7 @@ async def logout_user(request: Request) -> Response:
 
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request) -> HTMLResponse:
+def dashboard(request: Request) -> HTMLResponse:
     user = _current_user(request)
     if not user:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
@@ -567,19 +686,19 @@ async def dashboard(request: Request) -> HTMLResponse:
 
 
 @app.get("/privacy", response_class=HTMLResponse)
-async def privacy_policy(request: Request) -> HTMLResponse:
+async def privacy_policy() -> HTMLResponse:
     """Render the privacy policy page."""
-    return templates.TemplateResponse("privacy.html", {"request": request, "user": _current_user(request)})
+    return _static_page("privacy.html")
 
 
 @app.get("/terms", response_class=HTMLResponse)
-async def terms_of_service(request: Request) -> HTMLResponse:
+async def terms_of_service() -> HTMLResponse:
     """Render the terms of service page."""
-    return templates.TemplateResponse("terms.html", {"request": request, "user": _current_user(request)})
+    return _static_page("terms.html")
 
 
 @app.get("/verify-email", response_class=HTMLResponse)
-async def verify_email_endpoint(request: Request) -> Response:
+def verify_email_endpoint(request: Request) -> Response:
     """Verify a user's email address using the verification token."""
     token = request.query_params.get("token")
     
@@ -605,13 +724,13 @@ async def verify_email_endpoint(request: Request) -> Response:
 
 
 @app.get("/success", response_class=HTMLResponse)
-async def success_page(request: Request) -> HTMLResponse:
+async def success_page() -> HTMLResponse:
     """Show success page after successful Stripe checkout."""
-    return templates.TemplateResponse("success.html", {"request": request, "user": _current_user(request)})
+    return _static_page("success.html")
 
 
 @app.get("/settings", response_class=HTMLResponse)
-async def settings_page(request: Request) -> HTMLResponse:
+def settings_page(request: Request) -> HTMLResponse:
     """Show account settings page."""
     user = _current_user(request)
     if not user:
@@ -631,13 +750,13 @@ async def settings_page(request: Request) -> HTMLResponse:
 
 
 @app.get("/faq", response_class=HTMLResponse)
-async def faq_page(request: Request) -> HTMLResponse:
+async def faq_page() -> HTMLResponse:
     """Render the FAQ page."""
-    return templates.TemplateResponse("faq.html", {"request": request, "user": _current_user(request)})
+    return _static_page("faq.html")
 
 
 @app.get("/referrals", response_class=HTMLResponse)
-async def referrals_page(request: Request) -> HTMLResponse:
+def referrals_page(request: Request) -> HTMLResponse:
     """Show referral dashboard with code and tracking."""
     user = _current_user(request)
     if not user:
@@ -674,19 +793,19 @@ async def referrals_page(request: Request) -> HTMLResponse:
 
 
 @app.get("/promo", response_class=HTMLResponse)
-async def promo_page(request: Request) -> HTMLResponse:
+async def promo_page() -> HTMLResponse:
     """Show promotional page for free trial and referral program."""
-    return templates.TemplateResponse("promo.html", {"request": request, "user": _current_user(request)})
+    return _static_page("promo.html")
 
 
 @app.get("/for-resellers", response_class=HTMLResponse)
-async def resellers_promo_page(request: Request) -> HTMLResponse:
+async def resellers_promo_page() -> HTMLResponse:
     """Show promotional page specifically targeting resellers and flippers."""
-    return templates.TemplateResponse("promo_resellers.html", {"request": request, "user": _current_user(request)})
+    return _static_page("promo_resellers.html")
 
 
 @app.post("/admin/send-digests")
-async def send_weekly_digests(request: Request) -> JSONResponse:
+def send_weekly_digests(request: Request) -> JSONResponse:
     """Send weekly digest emails to all eligible free users. Admin endpoint."""
     from alerts import EmailService
     
@@ -702,33 +821,33 @@ async def send_weekly_digests(request: Request) -> JSONResponse:
     
     base_url = str(request.base_url).rstrip("/")
     
-    for user in free_users:
-        try:
-            # Get listings from past week matching user's criteria
-            # Extract keywords from user's search (this is simplified - you may need to store keywords)
-            listings = get_listings_from_past_week(
-                keywords="",  # You'd need to store user's search keywords
-                max_price=None,
-                min_bedrooms=None,
-                limit=10
-            )
+    with email_service:
+        for user in free_users:
+            try:
+                # Get listings from past week matching user's criteria
+                # Extract keywords from user's search (this is simplified - you may need to store keywords)
+                listings = get_listings_from_past_week(
+                    keywords="",  # You'd need to store user's search keywords
+                    max_price=None,
+                    limit=10
+                )
             
-            # Send digest
-            email_service.send_digest_email(
-                to_email=user.email,
-                referral_code=user.referral_code or "",
-                listings=listings,
-                base_url=base_url
-            )
+                # Send digest
+                email_service.send_digest_email(
+                    to_email=user.email,
+                    referral_code=user.referral_code or "",
+                    listings=listings,
+                    base_url=base_url
+                )
             
-            # Mark as sent
-            update_digest_sent(user.id)
-            sent_count += 1
-            logger.info(f"Digest sent to {user.email}")
+                # Mark as sent
+                update_digest_sent(user.id)
+                sent_count += 1
+                logger.info(f"Digest sent to {user.email}")
             
-        except Exception as exc:
-            error_count += 1
-            logger.error(f"Failed to send digest to {user.email}: {exc}")
+            except Exception as exc:
+                error_count += 1
+                logger.error(f"Failed to send digest to {user.email}: {exc}")
     
     return JSONResponse({
         "status": "completed",